@@ -23,8 +23,9 @@
 # SOFTWARE.
 
 from .energycalculations import weighted_energy
-from .inputoutput import readenergydata, readenergyfile, readfactors, readfactorsdata
+from .inputoutput import readenergydata, readenergyfile, readbuildingsfile, readfactors, readfactorsdata
 from .inputoutput import ep2string, ep2dict
+from .factors import FactorTable
 from .settings import *
 from . import cli
 
@@ -24,7 +24,16 @@
 
 """Cálculo de la eficiencia energética de los edificios según ISO/DIS 52000-1:2005"""
 
+import sys
+
 from .cli import main
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] == ['serve']:
+        from .service import main as servicemain
+        servicemain(sys.argv[2:])
+    elif sys.argv[1:2] == ['worker']:
+        from .worker import main as workermain
+        workermain(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Análisis de resultados para múltiples escenarios de cálculo
+
+Funciones para evaluar un edificio bajo múltiples valores de los parámetros
+de cálculo, datos energéticos inciertos (Monte Carlo) o distintos tamaños de
+la producción in situ, sin repetir el balance energético en cada caso. Se
+basan en el cálculo vectorizado con NumPy (npcalculations).
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from .energycalculations import VALIDORIGINS
+from .npcalculations import (SERIES, COMPONENTS, energydata2array, batchbalance, batchcomponents,
+                             seriesbalance, significant, weightingcoefs, weightcomponents,
+                             weighted_energy_batch, _ratio)
+
+# Perturbation models for Monte Carlo analysis (see weighted_energy_montecarlo)
+# - 'scale': the whole series is scaled by a single random factor
+# - 'noise': each timestep value is scaled by an independent random factor
+PERTURBATIONS = ['scale', 'noise']
+
+def weighted_energy_sweep(data, fp, k_rdels, k_exps):
+    """Total weighted energy (step A and A+B) for a grid of k_rdel and k_exp values
+
+    The energy balance is computed only once, as k_rdel only changes the
+    annual delivered energy (linearly, formula 38) and k_exp only scales
+    the step B grid savings.
+
+    Returns a data structure like weighted_energy, whose 'ren' and 'nren'
+    values are matrices with shape (len(k_rdels), len(k_exps)), where
+    element [i, j] is the result for k_rdels[i] and k_exps[j]. Step A
+    results don't depend on k_exp and are repeated along the columns.
+    """
+    k_rdels = np.asarray(k_rdels, dtype=float)
+    k_exps = np.asarray(k_exps, dtype=float)
+    carriers, values = energydata2array([data])
+    annual0, E_del_rdel_an = batchbalance(values[0])
+
+    # Annual components for each k_rdel value, shape (k_rdels, carriers, components)
+    annual = np.repeat(annual0[np.newaxis], len(k_rdels), axis=0)
+    annual[..., 0] -= k_rdels[:, np.newaxis] * E_del_rdel_an
+    annual = significant(annual)
+
+    # Step B savings are proportional to k_exp: evaluate them for k_exp = 1
+    coefsA, coefsAB1 = weightingcoefs(fp, carriers, 1.0)
+    EPA = weightcomponents(annual, coefsA, carriers)
+    EPAB1 = weightcomponents(annual, coefsAB1, carriers)
+
+    EP = {'EP': {}, 'EPpasoA': {}}
+    for ii, part in enumerate(('ren', 'nren')):
+        savings = EPA[ii] - EPAB1[ii]
+        EP['EPpasoA'][part] = np.repeat(EPA[ii][:, np.newaxis], len(k_exps), axis=1)
+        EP['EP'][part] = EPA[ii][:, np.newaxis] - savings[:, np.newaxis] * k_exps[np.newaxis, :]
+    return EP
+
+def weighted_energy_factorsets(data, fpsets, k_rdel, k_exp):
+    """Total weighted energy (step A and A+B) for several sets of weighting factors
+
+    fpsets is a dict of weighting factor sets (lists or FactorTables)
+    indexed by name, or a list of sets, which are then indexed by position.
+
+    The energy balance is computed only once and all factor sets are
+    applied to the annual components as a single matrix product.
+
+    Returns an ordered dict, indexed by factor set name (or position),
+    with the same data structure returned by weighted_energy.
+    """
+    if not hasattr(fpsets, 'keys'):
+        fpsets = OrderedDict(enumerate(fpsets))
+    names = list(fpsets.keys())
+    carriers, values = energydata2array([data])
+    annual = batchcomponents(values[0], k_rdel)
+
+    # Coefficients with shape (factor sets, steps A and A+B, ren and nren, carriers, components)
+    coefs = np.array([weightingcoefs(fpsets[name], carriers, k_exp) for name in names])
+    missing = np.isnan(coefs).any(axis=(1, 2)) & (annual != 0)
+    if missing.any():
+        raise ValueError("Weighting factors not found for: %s" % ', '.join(
+            "%s (%s, %s, %s)" % (names[ii], carriers[jj], COMPONENTS[kk][0], COMPONENTS[kk][1])
+            for (ii, jj, kk) in zip(*np.nonzero(missing))))
+    coefs = np.where(np.isnan(coefs), 0.0, coefs)
+
+    results = np.dot(coefs.reshape(coefs.shape[:3] + (-1,)), annual.ravel())
+    return OrderedDict((name, {'EP': {'ren': float(results[ii, 1, 0]), 'nren': float(results[ii, 1, 1])},
+                               'EPpasoA': {'ren': float(results[ii, 0, 0]), 'nren': float(results[ii, 0, 1])}})
+                       for ii, name in enumerate(names))
+
+def weighted_energy_montecarlo(data, fp, k_rdel, k_exp, perturbations, numsamples=1000,
+                               percentiles=(5, 50, 95), seed=None, chunksize=256):
+    """Percentiles of total weighted energy (step A and A+B) under uncertain energy data
+
+    perturbations is a list of (carrier, ctype, originoruse, model, sigma)
+    tuples, where model is one of PERTURBATIONS and sigma the standard
+    deviation of the normally distributed multiplicative factors (with mean
+    1) applied to the series of carrier, ctype and originoruse. Perturbed
+    values are clipped at zero.
+
+    numsamples perturbed copies of data are computed as batch arrays (see
+    weighted_energy_batch), chunksize samples at a time. Random factors are
+    drawn from a generator initialized with seed, so that results for the
+    same seed and chunksize can be reproduced.
+
+    Returns a dict with the list of 'percentiles' and keys 'EP' and
+    'EPpasoA' with arrays of the 'ren', 'nren' and 'rer' (renewable ratio)
+    values for those percentiles.
+    """
+    carriers, values = energydata2array([data])
+    positions = []
+    for (carrier, ctype, originoruse, model, sigma) in perturbations:
+        if carrier not in carriers:
+            raise ValueError("Carrier '%s' not found in energy data" % carrier)
+        if (ctype, originoruse) not in SERIES:
+            raise ValueError("Unknown energy data series '%s, %s'" % (ctype, originoruse))
+        if model not in PERTURBATIONS:
+            raise ValueError("Unknown perturbation model '%s'. Valid models: %s" % (model, ', '.join(PERTURBATIONS)))
+        positions.append((carriers.index(carrier), SERIES.index((ctype, originoruse)), model, sigma))
+
+    rng = np.random.default_rng(seed)
+    numsteps = values.shape[-1]
+    samples = {'EP': {'ren': [], 'nren': []}, 'EPpasoA': {'ren': [], 'nren': []}}
+    for start in range(0, numsamples, chunksize):
+        size = min(chunksize, numsamples - start)
+        chunk = np.repeat(values, size, axis=0)
+        for (jj, kk, model, sigma) in positions:
+            factors = rng.normal(1.0, sigma, size=(size, 1) if model == 'scale' else (size, numsteps))
+            chunk[:, jj, kk, :] = np.maximum(chunk[:, jj, kk, :] * factors, 0.0)
+        EP = weighted_energy_batch(chunk, carriers, fp, k_rdel, k_exp, chunksize)
+        for key in samples:
+            for part in samples[key]:
+                samples[key][part].append(EP[key][part])
+
+    results = {'percentiles': list(percentiles)}
+    for key in samples:
+        ren = np.concatenate(samples[key]['ren'])
+        nren = np.concatenate(samples[key]['nren'])
+        rer = _ratio(ren, ren + nren)
+        results[key] = {part: np.percentile(sample, percentiles)
+                        for (part, sample) in (('ren', ren), ('nren', nren), ('rer', rer))}
+    return results
+
+# Indicators for production sizing (see sizeproduction)
+# - 'nren': non renewable weighted energy (step A+B), must be at most the target
+# - 'rer': renewable energy ratio (step A+B), must be at least the target
+SIZINGINDICATORS = ['nren', 'rer']
+
+def weighted_energy_sizing(data, fp, k_rdel, k_exp, carrier, origin, profiles, capacities, chunksize=256):
+    """Total weighted energy (step A and A+B) for added on-site production of several sizes
+
+    Production of carrier from origin ('INSITU' or 'COGENERACION') equal to
+    capacity * profile is added to data, for each of the unit production
+    profiles (dict of profiles indexed by name, or list of profiles, then
+    indexed by position) and each of the capacities.
+
+    Energy data of the other carriers and the consumption of carrier don't
+    change between candidates and are used as a single array, broadcast
+    against the production series of all candidates, evaluated chunksize
+    capacities at a time.
+
+    Returns (names, EP), where names is the list of profile names, and EP
+    a data structure like weighted_energy, whose 'ren' and 'nren' values
+    are matrices with shape (len(profiles), len(capacities)).
+    """
+    if origin not in VALIDORIGINS:
+        raise ValueError("Production origin must be one of: %s" % ', '.join(VALIDORIGINS))
+    if not hasattr(profiles, 'keys'):
+        profiles = OrderedDict(enumerate(profiles))
+    names = list(profiles.keys())
+    capacities = np.asarray(capacities, dtype=float)
+    carriers = sorted(set(data) | set([carrier]))
+    _, values = energydata2array([data], carriers)
+    values = values[0]
+    jj = carriers.index(carrier)
+    unit = np.array([np.asarray(profiles[name], dtype=float) for name in names])
+    if unit.shape[-1] != values.shape[-1]:
+        raise ValueError("Production profiles must have %i timesteps" % values.shape[-1])
+
+    # Carriers other than carrier are computed once
+    annual0 = batchcomponents(values, k_rdel)
+    coefsA, coefsAB = weightingcoefs(fp, carriers, k_exp)
+
+    shape = (len(names), len(capacities))
+    EPA = {'ren': np.zeros(shape), 'nren': np.zeros(shape)}
+    EPB = {'ren': np.zeros(shape), 'nren': np.zeros(shape)}
+    for start in range(0, len(capacities), chunksize):
+        chunk = slice(start, start + chunksize)
+        vdata = {'CONSUMO': {}, 'PRODUCCION': {}}
+        for kk, (ctype, originoruse) in enumerate(SERIES):
+            vdata[ctype][originoruse] = values[jj, kk]
+        vdata['PRODUCCION'][origin] = (vdata['PRODUCCION'][origin]
+                                       + capacities[np.newaxis, chunk, np.newaxis] * unit[:, np.newaxis, :])
+        annual_cr, E_del_rdel_an = seriesbalance(vdata)
+        # Corrected delivered energy (formula 38)
+        annual_cr[..., 0] -= k_rdel * E_del_rdel_an
+        annual = np.repeat(np.repeat(annual0[np.newaxis, np.newaxis], len(names), axis=0),
+                           annual_cr.shape[1], axis=1)
+        annual[:, :, jj, :] = significant(annual_cr)
+        EPA['ren'][:, chunk], EPA['nren'][:, chunk] = weightcomponents(annual, coefsA, carriers)
+        EPB['ren'][:, chunk], EPB['nren'][:, chunk] = weightcomponents(annual, coefsAB, carriers)
+    return names, {'EP': EPB, 'EPpasoA': EPA}
+
+def sizeproduction(data, fp, k_rdel, k_exp, carrier, origin, profiles, capacities, target,
+                   indicator='nren', chunksize=256):
+    """Smallest production capacity for each profile that meets a target indicator
+
+    Candidates are evaluated with weighted_energy_sizing. indicator is one
+    of SIZINGINDICATORS: the step A+B non renewable weighted energy
+    ('nren') must be at most target, or the renewable energy ratio ('rer')
+    must be at least target.
+
+    Returns an ordered dict, indexed by profile name (or position), with
+    the smallest capacity meeting the target, or None if none does.
+    """
+    if indicator not in SIZINGINDICATORS:
+        raise ValueError("Unknown sizing indicator '%s'. Valid indicators: %s"
+                         % (indicator, ', '.join(SIZINGINDICATORS)))
+    capacities = np.sort(np.asarray(capacities, dtype=float))
+    names, EP = weighted_energy_sizing(data, fp, k_rdel, k_exp, carrier, origin, profiles, capacities, chunksize)
+    ren, nren = EP['EP']['ren'], EP['EP']['nren']
+    if indicator == 'nren':
+        meets = nren <= target
+    else:
+        meets = _ratio(ren, ren + nren) >= target
+    return OrderedDict((name, float(capacities[np.argmax(meets[ii])]) if meets[ii].any() else None)
+                       for ii, name in enumerate(names))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# 
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Cálculo por lotes de múltiples archivos de datos energéticos
+
+Los archivos se reparten entre varios procesos de cálculo. Cada proceso
+lee el archivo de factores de paso una sola vez y los resultados de cada
+edificio se escriben como una fila de un archivo CSV o JSON-lines.
+"""
+
+import csv
+import glob
+import json
+import multiprocessing
+
+from .settings import K_EXP, K_RDEL, FACTORESDEPASOOFICIALES
+from .inputoutput import readenergyfile, readfactors, ep2dict
+from .cache import ResultCache, cached_weighted_energy
+
+# Output fields: file name, calculation status, error message and ep2dict fields
+EPFIELDS = ['EPAren', 'EPAnren', 'EPAtotal', 'EPArer', 'EPren', 'EPnren', 'EPtotal', 'EPrer']
+FIELDS = ['file', 'status', 'error'] + EPFIELDS
+
+FORMATS = ['csv', 'jsonl']
+
+def expandpatterns(patterns):
+    """List of file names matching the list of file names or glob patterns
+
+    Patterns without matches are kept as file names, so that they get
+    reported as errors when processed.
+    """
+    filenames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        filenames.extend(matches if matches else [pattern])
+    return filenames
+
+# Calculation settings of each worker process, set by initworker
+_worker = {}
+
+def initworker(fpfilename=None, k_rdel=K_RDEL, k_exp=K_EXP, area=1.0, cachedir=None):
+    """Set calculation settings for the current process
+
+    The weighting factors file is read here, once per process. Results
+    are stored in a ResultCache in cachedir, unless it's None.
+    """
+    _worker['fp'] = FACTORESDEPASOOFICIALES if fpfilename is None else readfactors(fpfilename)
+    _worker['k_rdel'] = k_rdel
+    _worker['k_exp'] = k_exp
+    _worker['area'] = area
+    _worker['cache'] = None if cachedir is None else ResultCache(cachedir)
+
+def errorrow(filename, error):
+    """Result row for filename whose calculation failed with error"""
+    row = {'file': filename, 'status': 'error', 'error': u'%s' % error}
+    row.update((field, None) for field in EPFIELDS)
+    return row
+
+def processdata(filename, data):
+    """Compute energy efficiency indicators for data, read from filename, using worker settings
+
+    Weighting factors are checked (see checkfactors) after computing the
+    energy balance and before weighting it. Returns a dict with FIELDS keys. Errors are reported in
+    the 'status' and 'error' fields instead of being raised.
+    """
+    try:
+        EP = cached_weighted_energy(data, _worker['k_rdel'], _worker['fp'], _worker['k_exp'], _worker['cache'],
+                                    check=True)
+    except Exception as e:
+        return errorrow(filename, e)
+    row = {'file': filename, 'status': 'ok', 'error': ''}
+    row.update(ep2dict(EP, _worker['area']))
+    return row
+
+def processfile(filename):
+    """Compute energy efficiency indicators for filename using worker settings (see processdata)"""
+    try:
+        data = readenergyfile(filename)
+    except Exception as e:
+        return errorrow(filename, e)
+    return processdata(filename, data)
+
+def rowwriter(outfile, fmt):
+    """Writer of result rows to outfile in fmt format (see FORMATS)"""
+    if fmt not in FORMATS:
+        raise ValueError("Unknown output format '%s'. Valid formats: %s" % (fmt, ', '.join(FORMATS)))
+    return _CSVRowWriter(outfile) if fmt == 'csv' else _JSONRowWriter(outfile)
+
+class _CSVRowWriter(object):
+    def __init__(self, outfile):
+        self.writer = csv.DictWriter(outfile, fieldnames=FIELDS, lineterminator='\n')
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+class _JSONRowWriter(object):
+    def __init__(self, outfile):
+        self.outfile = outfile
+
+    def write(self, row):
+        self.outfile.write(json.dumps(row, sort_keys=True) + '\n')
+
+def runbatch(filenames, outfile, fpfilename=None, k_rdel=K_RDEL, k_exp=K_EXP,
+             area=1.0, jobs=1, fmt='csv', cachedir=None):
+    """Compute energy efficiency indicators for filenames and write them to outfile
+
+    Files are processed by a pool of jobs processes (in the current process
+    if jobs is 1) and results are written in input order, one row per file,
+    in 'csv' or 'jsonl' (JSON-lines) format. Results are cached in
+    cachedir, if given (see cache.ResultCache).
+
+    Returns the number of files whose calculation failed.
+    """
+    writer = rowwriter(outfile, fmt)
+    settings = (fpfilename, k_rdel, k_exp, area, cachedir)
+
+    if jobs == 1:
+        pool = None
+        initworker(*settings)
+        rows = (processfile(filename) for filename in filenames)
+    else:
+        chunksize = max(1, len(filenames) // (4 * jobs))
+        pool = multiprocessing.Pool(jobs, initializer=initworker, initargs=settings)
+        rows = pool.imap(processfile, filenames, chunksize)
+
+    numerrors = 0
+    try:
+        for row in rows:
+            numerrors += row['status'] != 'ok'
+            writer.write(row)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return numerrors
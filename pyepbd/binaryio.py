@@ -0,0 +1,268 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Binary format for energy data of multiple buildings
+
+Energy data (see inputoutput.readenergydata) of one or more buildings is
+stored in a single file as a contiguous block of little endian float64
+values, followed by a JSON index that describes the carrier, ctype and
+originoruse of each series and its position in the data block.
+
+File layout:
+
+- magic number (8 bytes): b'EPBDBIN1'
+- data block: float64 values, building after building
+- index: UTF-8 encoded JSON object:
+  {"buildings": [{"id": id, "numsteps": numsteps,
+                  "series": [[carrier, ctype, originoruse, offset], ...]}, ...]}
+  where offset is the position of the series in the data block (in values)
+- index position (8 bytes): little endian uint64 with the file offset of the index
+- magic number (8 bytes)
+
+The index is written last so that buildings can be written one at a time.
+Files are read through memory mapping, and series are returned as views
+over the mapped data block, without copies or parsing.
+
+Timestep components (energycomponents with temporal=True) use the same
+layout, with COMPONENTSMAGIC as magic number and series indexed by carrier,
+source and use.
+"""
+
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import weakref
+from array import array
+
+from .inputoutput import readenergyfile
+
+try:
+    _tobytes = array.tobytes
+except AttributeError: # Python 2
+    _tobytes = array.tostring
+
+MAGIC = b'EPBDBIN1'
+COMPONENTSMAGIC = b'EPBDCMP1'
+_TRAILER = struct.Struct('<Q8s')
+
+class BinaryWriter(object):
+    """Writer of nested series of buildings to filename in binary format
+
+    Buildings are added one at a time with write, so that only the data
+    of one building has to be kept in memory. magic identifies the kind of
+    data in the file (energy data with MAGIC, components with
+    COMPONENTSMAGIC). The index is written on close.
+    """
+
+    def __init__(self, filename, magic=MAGIC):
+        self.magic = magic
+        self._file = io.open(filename, 'wb')
+        self._file.write(magic)
+        self._index = []
+        self._offset = 0
+
+    def write(self, buildingid, data):
+        """Write data of building buildingid
+
+        data is a dict of dicts of series, indexed by three keys (e.g.
+        carrier, ctype and originoruse for energy data), all with the same
+        number of timesteps.
+        """
+        series = []
+        numsteps = None
+        for key1 in sorted(data):
+            for key2 in sorted(data[key1]):
+                for key3 in sorted(data[key1][key2]):
+                    values = array('d', data[key1][key2][key3])
+                    if numsteps is None:
+                        numsteps = len(values)
+                    elif len(values) != numsteps:
+                        raise ValueError("All series of building %s must have the same number "
+                                         "of timesteps" % buildingid)
+                    if sys.byteorder != 'little':
+                        values.byteswap()
+                    self._file.write(_tobytes(values))
+                    series.append([key1, key2, key3, self._offset])
+                    self._offset += numsteps
+        self._index.append({'id': u'%s' % buildingid, 'numsteps': numsteps or 0, 'series': series})
+
+    def close(self):
+        """Write the index and close the file"""
+        indexposition = self._file.tell()
+        self._file.write(json.dumps({'buildings': self._index}).encode('utf-8'))
+        self._file.write(_TRAILER.pack(indexposition, self.magic))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def writeenergybinary(filename, buildings):
+    """Write energy data of buildings to filename in binary format
+
+    buildings is an iterable of (id, energydata) pairs, where id is a
+    string identifying the building and energydata is the data structure
+    returned by readenergydata. Buildings are written as they are read
+    from the iterable.
+    """
+    with BinaryWriter(filename) as writer:
+        for buildingid, energydata in buildings:
+            writer.write(buildingid, energydata)
+
+def csv2binary(csvfilenames, filename, ids=None):
+    """Convert energy data files (CSV) to a single file in binary format
+
+    ids is the list of building identifiers, one for each file, and
+    defaults to the file names without extension.
+    """
+    if ids is None:
+        ids = [os.path.splitext(os.path.basename(csvfilename))[0] for csvfilename in csvfilenames]
+    writeenergybinary(filename, ((buildingid, readenergyfile(csvfilename))
+                                 for (buildingid, csvfilename) in zip(ids, csvfilenames)))
+
+class EnergyBinaryFile(object):
+    """Memory mapped energy data file in binary format
+
+    Energy data of each building is accessed by id or position, or by
+    iteration (yielding (id, energydata) pairs), and has the same structure
+    returned by readenergydata. Its series are read-only memoryviews of
+    float values over the mapped file (copies in Python 2, where memoryviews
+    can't be cast).
+
+    Series views are released when the file is closed, and can't be used
+    afterwards (copy them, e.g. with list(), to keep their values).
+    """
+    MAGIC = MAGIC
+    DESCRIPTION = 'an energy data file'
+
+    def __init__(self, filename):
+        self.filename = filename
+        with io.open(filename, 'rb') as ff:
+            self._mmap = mmap.mmap(ff.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._mmap)
+        magic = self.MAGIC
+        if (size < len(magic) + _TRAILER.size or self._mmap[:len(magic)] != magic
+                or self._mmap[size - len(magic):] != magic):
+            self._mmap.close()
+            raise ValueError("File %s is not %s in binary format" % (filename, self.DESCRIPTION))
+        indexposition, _ = _TRAILER.unpack(self._mmap[size - _TRAILER.size:])
+        self.index = json.loads(self._mmap[indexposition:size - _TRAILER.size].decode('utf-8'))['buildings']
+        self.ids = [building['id'] for building in self.index]
+        self._positions = dict((buildingid, ii) for (ii, buildingid) in enumerate(self.ids))
+        self._start = len(magic)
+        try:
+            self._data = memoryview(self._mmap)[self._start:indexposition]
+        except TypeError: # Python 2 mmap objects don't export buffers
+            self._data = None
+        self._views = []
+        self._maxviews = 1024
+
+    def _series(self, offset, numsteps):
+        start, end = 8 * offset, 8 * (offset + numsteps)
+        if self._data is None:
+            values = array('d', self._mmap[self._start + start:self._start + end])
+        else:
+            view = self._data[start:end]
+            if sys.byteorder == 'little':
+                return self._track(view.cast('d'))
+            values = array('d', view.tobytes())
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def _track(self, view):
+        """Keep a weak reference to view, to release it on close"""
+        self._views.append(weakref.ref(view))
+        if len(self._views) > self._maxviews:
+            self._views = [ref for ref in self._views if ref() is not None]
+            self._maxviews = max(1024, 2 * len(self._views))
+        return view
+
+    def _nested(self, building):
+        """Series of building, given by id or position, as nested dicts"""
+        position = self._positions[building] if building in self._positions else building
+        entry = self.index[position]
+        data = {}
+        for key1, key2, key3, offset in entry['series']:
+            data.setdefault(key1, {}).setdefault(key2, {})[key3] = self._series(offset, entry['numsteps'])
+        return data
+
+    def energydata(self, building):
+        """Energy data of building, given by id or position"""
+        return self._nested(building)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, building):
+        return self._nested(building)
+
+    def __iter__(self):
+        for position, buildingid in enumerate(self.ids):
+            yield buildingid, self._nested(position)
+
+    def close(self):
+        """Release the series views and the memory mapping of the file"""
+        for ref in self._views:
+            view = ref()
+            if view is not None:
+                view.release()
+        self._views = []
+        if self._data is not None:
+            self._data.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def readenergybinary(filename):
+    """Open energy data file in binary format (see EnergyBinaryFile)"""
+    return EnergyBinaryFile(filename)
+
+class ComponentsBinaryFile(EnergyBinaryFile):
+    """Memory mapped timestep components file in binary format
+
+    Timestep components of each building are accessed by id or position,
+    or by iteration (yielding (id, components) pairs), as dicts of
+    carrier -> source -> use -> series, as the 'temporal' part of
+    energycomponents results (see export.exportcomponents).
+    """
+    MAGIC = COMPONENTSMAGIC
+    DESCRIPTION = 'a components file'
+
+    def components(self, building):
+        """Timestep components of building, given by id or position"""
+        return self._nested(building)
+
+def readcomponentsbinary(filename):
+    """Open timestep components file in binary format (see ComponentsBinaryFile)"""
+    return ComponentsBinaryFile(filename)
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Persistent cache of weighted energy results
+
+Results of weighted_energy are stored on disk, one JSON file per result,
+indexed by a hash of the normalized energy data, weighting factors,
+k_rdel and k_exp. The cache has a size limit and removes the least
+recently used results when it's exceeded.
+
+Results are kept in a subdirectory for the current pyepbd version, and
+the results of other versions are removed when the cache is opened.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+from .energycalculations import weighted_energy
+from .factors import asfactortable
+
+try:
+    _tobytes = array.tobytes
+except AttributeError: # Python 2
+    _tobytes = array.tostring
+
+try:
+    _replace = os.replace
+except AttributeError: # Python 2
+    def _replace(src, dst):
+        try:
+            os.rename(src, dst)
+        except OSError: # dst exists (Windows), and holds the same result
+            os.remove(src)
+
+# Default cache size limit, in bytes
+MAXSIZE = 16 * 1024 * 1024
+
+def cachekey(data, fp, k_rdel, k_exp):
+    """Hash of energy data, weighting factors, k_rdel and k_exp
+
+    Data is normalized before hashing, so that the key doesn't depend on
+    the order of carriers or weighting factors, or on the type of the
+    series (lists, arrays...).
+    """
+    h = hashlib.sha256()
+    h.update(struct.pack('<dd', k_rdel, k_exp))
+    for carrier in sorted(data):
+        for ctype in sorted(data[carrier]):
+            for originoruse in sorted(data[carrier][ctype]):
+                values = array('d', data[carrier][ctype][originoruse])
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                h.update((u'\n%s|%s|%s|%i|' % (carrier, ctype, originoruse, len(values))).encode('utf-8'))
+                h.update(_tobytes(values))
+    fp = asfactortable(fp)
+    keys = sorted(set((fpi['vector'], fpi['fuente'], fpi['uso'], fpi['step']) for fpi in fp))
+    for key in keys:
+        factor = fp.factor(*key)
+        h.update((u'\n%s|%s|%s|%s|%r|%r' % (key + (float(factor['ren']), float(factor['nren'])))).encode('utf-8'))
+    return h.hexdigest()
+
+class ResultCache(object):
+    """Persistent cache of weighted energy results in directory cachedir
+
+    maxsize is the maximum size of stored results, in bytes.
+    """
+
+    def __init__(self, cachedir, maxsize=MAXSIZE):
+        from . import __version__
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.version = __version__
+        self.directory = os.path.join(cachedir, 'pyepbd-%s' % __version__)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Remove results from other versions
+        for name in os.listdir(cachedir):
+            path = os.path.join(cachedir, name)
+            if name.startswith('pyepbd-') and path != self.directory and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        self.size = sum(size for (_, _, size) in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _entries(self):
+        """List of (mtime, path, size) of stored results"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError: # removed by another process
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def get(self, key):
+        """Stored result for key, or None if it's not in the cache"""
+        path = self._path(key)
+        try:
+            with io.open(path, 'r', encoding='utf-8') as ff:
+                result = json.load(ff)
+            os.utime(path, None) # mark as recently used
+        except (IOError, OSError, ValueError):
+            return None
+        return result
+
+    def put(self, key, result):
+        """Store result for key, removing least recently used results if needed"""
+        content = json.dumps(result).encode('utf-8')
+        fd, tmppath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as ff:
+            ff.write(content)
+        _replace(tmppath, self._path(key))
+        self.size += len(content)
+        if self.size > self.maxsize:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used results until size is below maxsize"""
+        entries = sorted(self._entries())
+        self.size = sum(size for (_, _, size) in entries)
+        for (_, path, size) in entries:
+            if self.size <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
+
+    def clear(self):
+        """Remove all stored results"""
+        for (_, path, _) in self._entries():
+            os.remove(path)
+        self.size = 0
+
+def cached_weighted_energy(data, k_rdel, fp, k_exp, cache, backend='python', check=False):
+    """Total weighted energy (see weighted_energy), using cache for stored results
+
+    cache is a ResultCache, or None to compute without cache. Stored
+    results need no check, since they were computed with the same factors.
+    """
+    if cache is None:
+        return weighted_energy(data, k_rdel, fp, k_exp, backend, check)
+    key = cachekey(data, fp, k_rdel, k_exp)
+    result = cache.get(key)
+    if result is None:
+        result = weighted_energy(data, k_rdel, fp, k_exp, backend, check)
+        cache.put(key, result)
+    return result
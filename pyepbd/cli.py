@@ -25,10 +25,20 @@
 """Cálculo de la eficiencia energética de los edificios según ISO/DIS 52000-1:2005"""
 
 import argparse
+import os
 import sys
 from .settings import K_EXP, K_RDEL, FACTORESDEPASOOFICIALES
-from .energycalculations import weighted_energy
 from .inputoutput import readenergyfile, readfactors, ep2string
+from .batch import expandpatterns, runbatch, FORMATS
+from .cache import ResultCache, cached_weighted_energy
+from .profiling import profile
+
+def positiveint(value):
+    """Integer argument of at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(u'debe ser un entero mayor o igual que 1: %s' % value)
+    return number
 
 def main():
     from .__init__ import __version__
@@ -39,7 +49,10 @@ def main():
 \t         Rafael Villar Burke <pachi@ietcc.csic.es>
 """ % __version__
     parser = argparse.ArgumentParser(description=u'Cálculo de la eficiencia energética según ISO/DIS 52000-1:2015 y CTE DB-HE',
-                                     usage=u"%(prog)s [-h] [-f [FPFILE]] [--krdel [KRDEL]] [--kexp [KEXP]] vecfile\n\n" + COPY,
+                                     usage=(u"%(prog)s [-h] [-f [FPFILE]] [--krdel [KRDEL]] [--kexp [KEXP]] vecfile\n"
+                                            u"       %(prog)s [-h] [-f [FPFILE]] [--krdel [KRDEL]] [--kexp [KEXP]] "
+                                            u"[-j JOBS] [--format {csv,jsonl}] [--pipeline [--readers N] [--queue N]]\n"
+                                            u"       [-o OUTFILE] --batch PATTERN [PATTERN ...]\n\n" + COPY),
                                      formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument(dest='vecfile', nargs='?',
                         type=argparse.FileType('r'),
@@ -57,13 +70,47 @@ def main():
     parser.add_argument('-o', '--outfile', dest='outputfile', nargs='?',
                         type=argparse.FileType('w'), default=None,
                         help=u'archivo de salida de resultados')
+    parser.add_argument('--batch', dest='batch', nargs='+', default=None, metavar='PATTERN',
+                        help=u'archivos (o patrones) de datos para el cálculo por lotes')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=positiveint, default=1,
+                        help=u'número de procesos del cálculo por lotes')
+    parser.add_argument('--format', dest='format', choices=FORMATS, default=None,
+                        help=u'formato de salida del cálculo por lotes (csv o jsonl)')
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true', default=False,
+                        help=u'solapa lectura, cálculo y escritura en el cálculo por lotes (Python 3.7+)')
+    parser.add_argument('--readers', dest='readers', type=positiveint, default=4,
+                        help=u'número de lectores concurrentes del cálculo por lotes con --pipeline')
+    parser.add_argument('--queue', dest='queuesize', type=positiveint, default=64,
+                        help=u'tamaño de las colas entre etapas del cálculo por lotes con --pipeline')
+    parser.add_argument('--cache-dir', dest='cachedir', default=None,
+                        help=u'directorio de la caché de resultados')
+    parser.add_argument('--profile', dest='profile', action='store_true', default=False,
+                        help=u'muestra el tiempo, tamaño de datos y memoria de cada etapa del cálculo')
     args = parser.parse_args()
 
+    if args.profile:
+        with profile(tracememory=True) as report:
+            status = mainrun(parser, args)
+        sys.stderr.write(report.report())
+        if args.batch and args.jobs > 1:
+            sys.stderr.write(u'(no incluye las etapas ejecutadas en otros procesos)\n')
+    else:
+        status = mainrun(parser, args)
+    if status:
+        sys.exit(status)
+
+def mainrun(parser, args):
+    """Run calculation for command line arguments and return exit status"""
+    if args.batch:
+        if args.pipeline and sys.version_info < (3, 7):
+            parser.error(u'el cálculo por lotes con --pipeline requiere Python 3.7 o posterior')
+        return mainbatch(args)
+
     cadenasalida = []
 
     if not args.vecfile:
         parser.print_help()
-        sys.exit(2)
+        return 2
     cadenasalida.append(u'%s' % args.vecfile.name)
 
     if args.krdel is None:
@@ -85,12 +132,17 @@ def main():
         fpdatafile = None
         cadenasalida.append(u'Usando factores de paso predefinidos')
     fP = (FACTORESDEPASOOFICIALES if args.fpfile is None
-          else readfactors(args.fpfile))
+          else readfactors(args.fpfile.name))
 
     cadenasalida.append(u'Superficie de referencia: %.2f' % args.area)
 
+    cache = None if args.cachedir is None else ResultCache(args.cachedir)
+
     data = readenergyfile(args.vecfile.name)
-    EP = weighted_energy(data, k_rdel, fP, k_exp)
+    try:
+        EP = cached_weighted_energy(data, k_rdel, fP, k_exp, cache, check=True)
+    except ValueError as e:
+        parser.error(u'%s' % e)
 
     cadenasalida.append(ep2string(EP, args.area))
     cadenasalida = u'\n'.join(cadenasalida)
@@ -99,6 +151,34 @@ def main():
     if args.outputfile:
         print(u'Guardando resultados en el archivo: %s' % args.outputfile.name)
         args.outputfile.write(cadenasalida.encode('utf-8'))
+    return 0
+
+def mainbatch(args):
+    """Batch calculation for the files in args.batch
+
+    Results are written to the output file (standard output by default)
+    and a summary is printed to standard error.
+    """
+    filenames = expandpatterns(args.batch)
+    k_rdel = K_RDEL if args.krdel is None else args.krdel
+    k_exp = K_EXP if args.kexp is None else args.kexp
+    fpfilename = None if args.fpfile is None else args.fpfile.name
+    outfile = args.outputfile if args.outputfile else sys.stdout
+    fmt = args.format
+    if fmt is None:
+        fmt = 'jsonl' if os.path.splitext(outfile.name)[1] in ('.jsonl', '.json') else 'csv'
+
+    if args.pipeline:
+        from .pipeline import runpipeline
+        stats = runpipeline(filenames, outfile, fpfilename, k_rdel, k_exp, args.area, args.jobs, fmt,
+                            args.cachedir, args.readers, args.queuesize)
+        numfiles, numerrors = stats['buildings'], stats['errors']
+        sys.stderr.write(u'Tiempo: %.2f s (%.1f edificios/s)\n' % (stats['seconds'], stats['rate']))
+    else:
+        numfiles = len(filenames)
+        numerrors = runbatch(filenames, outfile, fpfilename, k_rdel, k_exp, args.area, args.jobs, fmt, args.cachedir)
+    sys.stderr.write(u'Procesados %i archivos (%i con errores)\n' % (numfiles, numerrors))
+    return 1 if numerrors else 0
 
 if __name__ == '__main__':
     main()
@@ -57,11 +57,21 @@ El cálculo está organizado por:
     - destino o uso de la energía.
 """
 
+from functools import partial
+from itertools import repeat
 from .utils import *
+from .factors import asfactortable
+from .profiling import profiled, argsize, carriersize
 
 # origin for produced energy must be either 'INSITU' or 'COGENERACION'
 VALIDORIGINS = ['INSITU', 'COGENERACION']
 
+# Calculation backends for the energy balance by carrier
+# - 'python': pure Python reference implementation (this module)
+# - 'numpy': vectorized implementation using NumPy (npcalculations module)
+# - 'fused': pure Python single pass implementation (annualsums_forcarrier)
+BACKENDS = ['python', 'numpy', 'fused']
+
 def components_t_forcarrier(vdata, k_rdel):
     """Calculate energy components for each time step from energy carrier data
 
@@ -146,7 +156,7 @@ def components_t_forcarrier(vdata, k_rdel):
     # Corrected temporary exported energy (formula 39)
     # E_exp_tmp_t_corr = [E_exp_tmp_ti * (1 - k_rdel) for E_exp_tmp_ti in E_exp_tmp_t] # not used
 
-    components_t = {'grid': {'input': sum(E_del_t_corr)}} # Scalar
+    components_t = {'grid': {'input': E_del_t_corr}}
 
     components_t.update({origin: {'input': E_pr_t_byorigin[origin],
                                   'to_nEPB': E_exp_used_nEPus_t_byorigin[origin],
@@ -160,27 +170,198 @@ def components_an_forcarrier(components_t):
         components_an[origin] = {}
         components_t_byorigin = components_t[origin]
         for use in components_t_byorigin:
-            try: # we get a list
-                sumforuse = sum(components_t_byorigin[use])
-            except TypeError: # if origin == 'grid' and use == 'input' we get an scalar
-                sumforuse = components_t_byorigin[use]
+            sumforuse = sum(components_t_byorigin[use])
             if abs(sumforuse) > 0.1:
                 components_an[origin][use] = sumforuse
     return components_an
 
-def energycomponents(energydata, k_rdel):
-    "Calculate timestep and annual energy composition by carrier from input data"
+######## Fused single pass balance ########
+
+def newannualsums():
+    """Empty annual sums of the energy balance of a carrier (see annualsums_forcarrier)"""
+    return {'E_del_an': 0.0,
+            'E_exp_nused_an': 0.0,
+            'byorigin': {origin: {'input': 0.0, 'to_nEPB': 0.0, 'exp_nused': 0.0}
+                         for origin in VALIDORIGINS}}
+
+def annualsums_forcarrier(vdata, sums=None):
+    """Annual sums of the energy balance of a carrier in a single pass
+
+    Computes, in one loop over the timesteps and without intermediate
+    series, the annual delivered energy (formula 30), the annual exported
+    energy not used for any service (formula 28) and, by origin, the
+    produced energy, the exported energy used for non-EPB services and the
+    exported energy not used for any service. Timestep values follow the
+    same formulas as components_t_forcarrier (23 to 29).
+
+    Sums are added to sums (from newannualsums), if given, so that
+    timesteps can be processed in batches. Missing series are taken as zero.
+    """
+    if sums is None:
+        sums = newannualsums()
+    consumption = vdata.get('CONSUMO', {})
+    production = vdata.get('PRODUCCION', {})
+    series = [consumption.get('EPB'), consumption.get('NEPB')] + [production.get(origin) for origin in VALIDORIGINS]
+    if all(values is None for values in series):
+        return sums
+    series = [repeat(0.0) if values is None else values for values in series]
+
+    origin1, origin2 = VALIDORIGINS
+    sums1, sums2 = sums['byorigin'][origin1], sums['byorigin'][origin2]
+    E_del_an, E_exp_nused_an = sums['E_del_an'], sums['E_exp_nused_an']
+    input1, to_nEPB1, exp_nused1 = sums1['input'], sums1['to_nEPB'], sums1['exp_nused']
+    input2, to_nEPB2, exp_nused2 = sums2['input'], sums2['to_nEPB'], sums2['exp_nused']
+    for (E_EPus, E_nEPus, E_pr1, E_pr2) in zip(*series):
+        input1 += E_pr1
+        input2 += E_pr2
+        E_pr = E_pr1 + E_pr2 # formula 23
+        E_pr_used_EPus = min(E_EPus, E_pr) # formula 24
+        E_del_an += E_EPus - E_pr_used_EPus # formulas 29 and 30
+        E_exp = E_pr - E_pr_used_EPus # formula 25
+        E_exp_used_nEPus = min(E_exp, E_nEPus) # formula 26
+        E_exp_nused = E_exp - E_exp_used_nEPus # formula 27
+        E_exp_nused_an += E_exp_nused # formula 28
+        if E_exp != 0:
+            # Split of exported energy by origin, weighting done by produced and exported energy
+            F_exp = E_exp / E_pr if E_pr != 0 else 0
+            F_exp_used_nEPus = E_exp_used_nEPus / E_exp
+            F_exp_nused = E_exp_nused / E_exp
+            E_exp1 = E_pr1 * F_exp
+            E_exp2 = E_pr2 * F_exp
+            to_nEPB1 += E_exp1 * F_exp_used_nEPus
+            to_nEPB2 += E_exp2 * F_exp_used_nEPus
+            exp_nused1 += E_exp1 * F_exp_nused
+            exp_nused2 += E_exp2 * F_exp_nused
+
+    sums['E_del_an'], sums['E_exp_nused_an'] = E_del_an, E_exp_nused_an
+    sums1['input'], sums1['to_nEPB'], sums1['exp_nused'] = input1, to_nEPB1, exp_nused1
+    sums2['input'], sums2['to_nEPB'], sums2['exp_nused'] = input2, to_nEPB2, exp_nused2
+    return sums
+
+def _redelivery(sums):
+    """Annual redelivered energy and share of exported energy to the grid (formulas 31 to 35)"""
+    E_del_an = sums['E_del_an']
+    E_exp_nused_an = sums['E_exp_nused_an']
+    E_exp_tmp_an = min(E_exp_nused_an, E_del_an)
+    E_del_rdel_an = E_exp_tmp_an if E_del_an != 0 else 0.0
+    E_exp_grid_an = E_exp_nused_an - E_exp_tmp_an
+    F_exp_grid_an = E_exp_grid_an / E_exp_nused_an if E_exp_nused_an != 0 else 0
+    return E_del_rdel_an, F_exp_grid_an
+
+def components_an_fromsums(sums, k_rdel):
+    """Annual energy composition of a carrier from its annual sums
+
+    Returns the same data structure as components_an_forcarrier.
+    """
+    E_del_rdel_an, F_exp_grid_an = _redelivery(sums)
+    # Annual corrected delivered energy (formula 38)
+    values = {'grid': {'input': sums['E_del_an'] - k_rdel * E_del_rdel_an}}
+    for origin in VALIDORIGINS:
+        sums_byorigin = sums['byorigin'][origin]
+        values[origin] = {'input': sums_byorigin['input'],
+                          'to_nEPB': sums_byorigin['to_nEPB'],
+                          'to_grid': sums_byorigin['exp_nused'] * F_exp_grid_an}
+    components_an = {}
+    for origin in values:
+        components_an[origin] = {use: value for (use, value) in values[origin].items() if abs(value) > 0.1}
+    return components_an
+
+def components_t_fromsums(vdata, sums, k_rdel):
+    """Timestep energy composition of a carrier from its annual sums
+
+    Second pass over the timesteps, needed only for timestep results,
+    once the annual redelivery proportions are known.
+
+    Returns the same data structure as components_t_forcarrier.
+    """
+    E_del_an = sums['E_del_an']
+    E_del_rdel_an, F_exp_grid_an = _redelivery(sums)
+    F_del_rdel_an = E_del_rdel_an / E_del_an if E_del_an != 0 else 0
+
+    E_EPus_t = vdata['CONSUMO']['EPB']
+    E_nEPus_t = vdata['CONSUMO']['NEPB']
+    E_pr_t_byorigin = vdata['PRODUCCION']
+    origin1, origin2 = VALIDORIGINS
+    to_nEPB1, to_nEPB2, to_grid1, to_grid2 = [], [], [], []
+    E_del_t_corr = []
+    for (E_EPus, E_nEPus, E_pr1, E_pr2) in zip(E_EPus_t, E_nEPus_t,
+                                               E_pr_t_byorigin[origin1], E_pr_t_byorigin[origin2]):
+        E_pr = E_pr1 + E_pr2
+        E_pr_used_EPus = min(E_EPus, E_pr)
+        E_del = E_EPus - E_pr_used_EPus
+        E_del_t_corr.append(E_del - k_rdel * F_del_rdel_an * E_del)
+        E_exp = E_pr - E_pr_used_EPus
+        E_exp_used_nEPus = min(E_exp, E_nEPus)
+        if E_exp != 0:
+            F_exp = E_exp / E_pr if E_pr != 0 else 0
+            F_exp_used_nEPus = E_exp_used_nEPus / E_exp
+            F_exp_grid = (E_exp - E_exp_used_nEPus) / E_exp * F_exp_grid_an
+            E_exp1 = E_pr1 * F_exp
+            E_exp2 = E_pr2 * F_exp
+            to_nEPB1.append(E_exp1 * F_exp_used_nEPus)
+            to_nEPB2.append(E_exp2 * F_exp_used_nEPus)
+            to_grid1.append(E_exp1 * F_exp_grid)
+            to_grid2.append(E_exp2 * F_exp_grid)
+        else:
+            to_nEPB1.append(0.0)
+            to_nEPB2.append(0.0)
+            to_grid1.append(0.0)
+            to_grid2.append(0.0)
+
+    components_t = {'grid': {'input': E_del_t_corr}}
+    components_t[origin1] = {'input': E_pr_t_byorigin[origin1], 'to_nEPB': to_nEPB1, 'to_grid': to_grid1}
+    components_t[origin2] = {'input': E_pr_t_byorigin[origin2], 'to_nEPB': to_nEPB2, 'to_grid': to_grid2}
+    return components_t
+
+def fused_components_forcarrier(vdata, k_rdel, temporal=False):
+    """Annual (and optionally timestep) components of a carrier using the fused balance"""
+    sums = annualsums_forcarrier(vdata)
+    components = {'anual': components_an_fromsums(sums, k_rdel)}
+    if temporal:
+        components['temporal'] = components_t_fromsums(vdata, sums, k_rdel)
+    return components
 
-    components = {}
-    for carrier in energydata:
-        bal_t = components_t_forcarrier(energydata[carrier], k_rdel)
-        bal_an = components_an_forcarrier(bal_t)
-        components[carrier] = {'temporal': bal_t,
-                               'anual': bal_an}
+def _twopasscomponents(forcarrier_t, forcarrier_an, vdata, k_rdel, temporal=False):
+    """Annual (and optionally timestep) components of a carrier from its timestep components"""
+    bal_t = forcarrier_t(vdata, k_rdel)
+    components = {'anual': forcarrier_an(bal_t)}
+    if temporal:
+        components['temporal'] = bal_t
     return components
 
+def backendfunction(backend):
+    """Return carrier components function for backend
+
+    The function is called as forcarrier(vdata, k_rdel, temporal) and
+    returns a dict with the carrier 'anual' (and 'temporal') components.
+    """
+    if backend == 'python':
+        return partial(_twopasscomponents, components_t_forcarrier, components_an_forcarrier)
+    elif backend == 'numpy':
+        from . import npcalculations
+        return partial(_twopasscomponents, npcalculations.components_t_forcarrier,
+                       npcalculations.components_an_forcarrier)
+    elif backend == 'fused':
+        return fused_components_forcarrier
+    raise ValueError("Unknown calculation backend '%s'. Valid backends: %s" % (backend, ', '.join(BACKENDS)))
+
+@profiled('energycomponents', argsize)
+def energycomponents(energydata, k_rdel, backend='python', temporal=False):
+    """Calculate annual (and optionally timestep) energy composition by carrier from input data
+
+    Returns a dict of carrier -> {'anual': annual components}. Timestep
+    components of each carrier are reduced to annual values as soon as
+    they are computed and then released, unless temporal is True, in which
+    case they are also returned as carrier -> {'temporal': components}.
+
+    backend selects the implementation of the energy balance (see BACKENDS).
+    """
+    forcarrier = backendfunction(backend)
+    return {carrier: forcarrier(energydata[carrier], k_rdel, temporal) for carrier in energydata}
+
 ####################################################
 
+@profiled('delivered_weighted_energy_stepA', carriersize)
 def delivered_weighted_energy_stepA(components, fp):
     """Total delivered (or produced) weighted energy entering the assessment boundary in step A
 
@@ -191,15 +372,16 @@ def delivered_weighted_energy_stepA(components, fp):
     """
 
     delivered_wenergy_stepA = {'ren': 0.0, 'nren': 0.0}
-    fpA = [fpi for fpi in fp if fpi['uso']=='input' and fpi['step']=='A']
+    fp = asfactortable(fp)
     for source in components:
         origins = components[source]
         if 'input' in origins:
-            factor_paso_A = [fpi for fpi in fpA if fpi['fuente']==source][0]
+            factor_paso_A = fp.sourcefactor(source, 'input', 'A')
             delivered_wenergy_stepA = {'ren': delivered_wenergy_stepA['ren'] + factor_paso_A['ren'] * origins['input'],
                                        'nren': delivered_wenergy_stepA['nren'] + factor_paso_A['nren'] * origins['input'] }
     return delivered_wenergy_stepA
 
+@profiled('exported_weighted_energy_stepA', carriersize)
 def exported_weighted_energy_stepA(components, fpA):
     """Total exported weighted energy going outside the assessment boundary in step A
 
@@ -211,17 +393,16 @@ def exported_weighted_energy_stepA(components, fpA):
 
     to_nEPB = {'ren': 0.0, 'nren': 0.0}
     to_grid = {'ren': 0.0, 'nren': 0.0}
-    fpAnEPB = [fpi for fpi in fpA if fpi['uso']=='to_nEPB']
-    fpAgrid = [fpi for fpi in fpA if fpi['uso']=='to_grid']
+    fpA = asfactortable(fpA)
     for source in components:
         destinations = components[source]
         if 'to_nEPB' in destinations:
-            fp_tmp = [fpi for fpi in fpAnEPB if fpi['fuente']==source][0] # TODO: check whether there's data
+            fp_tmp = fpA.sourcefactor(source, 'to_nEPB', 'A')
             to_nEPB = { 'ren': to_nEPB['ren'] + fp_tmp['ren'] * destinations['to_nEPB'],
                         'nren': to_nEPB['nren'] + fp_tmp['nren'] * destinations['to_nEPB'] }
 
         if 'to_grid' in destinations:
-            fp_tmp = [fpi for fpi in fpAgrid if fpi['fuente']==source][0] # TODO: check whether there's data
+            fp_tmp = fpA.sourcefactor(source, 'to_grid', 'A')
             to_grid = { 'ren': to_grid['ren'] + fp_tmp['ren'] * destinations['to_grid'],
                         'nren': to_grid['nren'] + fp_tmp['nren'] * destinations['to_grid'] }
 
@@ -229,6 +410,7 @@ def exported_weighted_energy_stepA(components, fpA):
                               'nren': to_nEPB['nren'] + to_grid['nren'] }
     return exported_energy_stepA
 
+@profiled('gridsavings_stepB', carriersize)
 def gridsavings_stepB(components, fp, k_exp):
     """Avoided weighted energy resources in the grid due to exported electricity
 
@@ -242,30 +424,61 @@ def gridsavings_stepB(components, fp, k_exp):
 
     to_nEPB = {'ren': 0.0, 'nren': 0.0}
     to_grid = {'ren': 0.0, 'nren': 0.0}
-    fpA = [fpi for fpi in fp if fpi['step']=='A']
-    fpB = [fpi for fpi in fp if fpi['step']=='B']
-    fpAnEPB = [fpi for fpi in fpA if fpi['uso']=='to_nEPB']
-    fpAgrid = [fpi for fpi in fpA if fpi['uso']=='to_grid']
-    fpBnEPB = [fpi for fpi in fpB if fpi['uso']=='to_nEPB']
-    fpBgrid = [fpi for fpi in fpB if fpi['uso']=='to_grid']
+    fp = asfactortable(fp)
 
     for source in components:
         destinations = components[source]
         if 'to_nEPB' in destinations:
-            fpA_tmp = [fpi for fpi in fpAnEPB if fpi['fuente']==source][0] # TODO: check whether there's data
-            fpB_tmp = [fpi for fpi in fpBnEPB if fpi['fuente']==source][0] # TODO: check whether there's data
+            fpA_tmp = fp.sourcefactor(source, 'to_nEPB', 'A')
+            fpB_tmp = fp.sourcefactor(source, 'to_nEPB', 'B')
             to_nEPB = { 'ren': to_nEPB['ren'] + (fpB_tmp['ren'] - fpA_tmp['ren']) * destinations['to_nEPB'],
                         'nren': to_nEPB['nren'] + (fpB_tmp['nren'] - fpA_tmp['nren']) * destinations['to_nEPB'] }
         if 'to_grid' in destinations:
-            fpA_tmp = [fpi for fpi in fpAgrid if fpi['fuente']==source][0] # TODO: check whether there's data
-            fpB_tmp = [fpi for fpi in fpBgrid if fpi['fuente']==source][0] # TODO: check whether there's data
+            fpA_tmp = fp.sourcefactor(source, 'to_grid', 'A')
+            fpB_tmp = fp.sourcefactor(source, 'to_grid', 'B')
             to_grid = { 'ren': to_grid['ren'] + (fpB_tmp['ren'] - fpA_tmp['ren']) * destinations['to_grid'],
                         'nren': to_grid['nren'] + (fpB_tmp['nren'] - fpA_tmp['nren']) * destinations['to_grid'] }
 
     gridsavings = {'ren': k_exp * (to_nEPB['ren'] + to_grid['ren']), 'nren': k_exp * (to_nEPB['nren'] + to_grid['nren'])}
     return gridsavings
 
-def weighted_energy(data, k_rdel, fp, k_exp):
+def requiredfactors(components):
+    """Weighting factors needed to compute the weighted energy of energy components
+
+    components is the data structure returned by energycomponents, whose
+    significant annual components are the ones that are weighted. Returns a
+    set of (carrier, source, use, step) tuples, including:
+
+    - grid and produced energy input (step A)
+    - exported energy to non-EPB uses and to the grid (steps A and B)
+
+    These are the factors used by weighted_energy_forcarrier.
+    """
+    required = set()
+    for carrier in components:
+        components_an = components[carrier]['anual']
+        for source in components_an:
+            for use in components_an[source]:
+                steps = ('A',) if use == 'input' else ('A', 'B')
+                required.update((carrier, source, use, step) for step in steps)
+    return required
+
+def missingfactors(components, fp):
+    """Sorted list of weighting factors needed by components (see requiredfactors) not found in fp"""
+    fp = asfactortable(fp)
+    return sorted(key for key in requiredfactors(components) if fp.factor(*key) is None)
+
+def checkfactors(components, fp):
+    """Check that fp has all weighting factors needed by energy components
+
+    Raises ValueError listing all missing weighting factors.
+    """
+    missing = missingfactors(components, fp)
+    if missing:
+        raise ValueError("Weighting factors not found (carrier, source, use, step): %s"
+                         % '; '.join(', '.join(key) for key in missing))
+
+def weighted_energy(data, k_rdel, fp, k_exp, backend='python', check=False):
     """Total weighted energy (step A + B) = used energy (step A) - saved energy (step B)
 
     The energy saved to the grid due to exportation (step B) is substracted
@@ -277,25 +490,54 @@ def weighted_energy(data, k_rdel, fp, k_exp):
 
     In the context of the CTE regulation weighted energy corresponds to
     primary energy.
+
+    The energy balance is computed with the selected backend (see
+    BACKENDS), all giving the same results up to rounding errors. Only
+    annual components are kept while computing it.
+
+    With check, the energy components are checked for missing weighting
+    factors before weighting them, and all of them are reported (see
+    checkfactors).
     """
-    components = energycomponents(data, k_rdel)
-    EPA = {'ren': 0.0, 'nren': 0.0}
-    EPB = {'ren': 0.0, 'nren': 0.0}
+    components = energycomponents(data, k_rdel, backend)
+    if check:
+        checkfactors(components, fp)
+    return weighted_energy_fromcomponents(components, fp, k_exp)
 
-    for carrier in components:
-        fp_cr = [fpi for fpi in fp if fpi['vector'] == carrier]
-        components_cr_an = components[carrier]['anual']
+def weighted_energy_forcarrier(components_cr_an, fp_cr, k_exp):
+    """Weighted energy (step A and step A + B) of a single energy carrier
+
+    components_cr_an are the annual components of the carrier and fp_cr
+    its weighting factors.
+
+    Returns a data structure with keys 'EP' (step A + B) and 'EPpasoA'
+    (step A), each with keys 'ren' and 'nren'.
+    """
+    delivered_wenergy_stepA = delivered_weighted_energy_stepA(components_cr_an, fp_cr)
+    exported_wenergy_stepA = exported_weighted_energy_stepA(components_cr_an, fp_cr)
+    weighted_energy_stepA = { 'ren': delivered_wenergy_stepA['ren'] - exported_wenergy_stepA['ren'],
+                              'nren': delivered_wenergy_stepA['nren'] - exported_wenergy_stepA['nren'] }
 
-        delivered_wenergy_stepA = delivered_weighted_energy_stepA(components_cr_an, fp_cr)
-        exported_wenergy_stepA = exported_weighted_energy_stepA(components_cr_an, fp_cr)
-        weighted_energy_stepA = { 'ren': delivered_wenergy_stepA['ren'] - exported_wenergy_stepA['ren'],
-                                  'nren': delivered_wenergy_stepA['nren'] - exported_wenergy_stepA['nren'] }
+    gsavings_stepB = gridsavings_stepB(components_cr_an, fp_cr, k_exp)
+    weighted_energy_stepAB = { 'ren': weighted_energy_stepA['ren'] - gsavings_stepB['ren'],
+                               'nren': weighted_energy_stepA['nren'] - gsavings_stepB['nren'] }
+    return {'EP': weighted_energy_stepAB, 'EPpasoA': weighted_energy_stepA}
 
-        gsavings_stepB = gridsavings_stepB(components_cr_an, fp_cr, k_exp)
-        weighted_energy_stepAB = { 'ren': weighted_energy_stepA['ren'] - gsavings_stepB['ren'],
-                                   'nren': weighted_energy_stepA['nren'] - gsavings_stepB['nren'] }
+def weighted_energy_fromcomponents(components, fp, k_exp):
+    """Total weighted energy (step A + B) from energy components
 
-        EPA = {'ren': EPA['ren'] + weighted_energy_stepA['ren'], 'nren': EPA['nren'] + weighted_energy_stepA['nren']}
-        EPB = {'ren': EPB['ren'] + weighted_energy_stepAB['ren'], 'nren': EPB['nren'] + weighted_energy_stepAB['nren']}
+    components is the data structure returned by energycomponents. Only
+    its annual ('anual') components are used.
+
+    Returns the same data structure as weighted_energy.
+    """
+    fp = asfactortable(fp)
+    EPA = {'ren': 0.0, 'nren': 0.0}
+    EPB = {'ren': 0.0, 'nren': 0.0}
+
+    for carrier in components:
+        EP_cr = weighted_energy_forcarrier(components[carrier]['anual'], fp.forcarrier(carrier), k_exp)
+        EPA = {'ren': EPA['ren'] + EP_cr['EPpasoA']['ren'], 'nren': EPA['nren'] + EP_cr['EPpasoA']['nren']}
+        EPB = {'ren': EPB['ren'] + EP_cr['EP']['ren'], 'nren': EPB['nren'] + EP_cr['EP']['nren']}
 
     return {'EP': EPB, 'EPpasoA': EPA}
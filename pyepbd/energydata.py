@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Almacenamiento compacto de datos energéticos
+
+CarrierData guarda los datos energéticos de un vector energético en un único
+array contiguo de valores float64, sin almacenar las series nulas. Se comporta
+como un diccionario de solo lectura con la misma estructura que los datos de
+un vector energético de readenergydata, de modo que puede usarse en su lugar
+en las funciones de cálculo:
+
+    vdata['CONSUMO']['EPB'] -> serie de valores (memoryview de float64)
+
+Los datos energéticos de un edificio en formato compacto son un diccionario
+de CarrierData por vector energético (ver compactenergydata).
+"""
+
+from array import array
+
+try:
+    from collections.abc import Mapping
+except ImportError: # Python 2
+    from collections import Mapping
+
+# Energy data series of a carrier, as (ctype, originoruse)
+SERIES = [('CONSUMO', 'EPB'), ('CONSUMO', 'NEPB'),
+          ('PRODUCCION', 'INSITU'), ('PRODUCCION', 'COGENERACION')]
+CTYPES = ['CONSUMO', 'PRODUCCION']
+
+# Shared read-only zero series, by length
+_zeros = {}
+
+try:
+    memoryview(array('d'))
+    def _seriesview(values, start, end):
+        return memoryview(values)[start:end]
+except TypeError: # Python 2 arrays don't export buffers
+    def _seriesview(values, start, end):
+        return values[start:end]
+
+def zeroseries(numsteps):
+    """Read-only series of numsteps zeros, shared by all callers"""
+    series = _zeros.get(numsteps)
+    if series is None:
+        try:
+            series = memoryview(bytes(8 * numsteps)).cast('d')
+        except (AttributeError, TypeError): # Python 2
+            series = (0.0,) * numsteps
+        _zeros[numsteps] = series
+    return series
+
+class _CtypeView(Mapping):
+    """Read-only view of the series of a CarrierData for ctype"""
+    __slots__ = ('_record', '_ctype')
+
+    def __init__(self, record, ctype):
+        self._record = record
+        self._ctype = ctype
+
+    def __getitem__(self, originoruse):
+        return self._record.series(self._ctype, originoruse)
+
+    def __iter__(self):
+        return (originoruse for (ctype, originoruse) in SERIES if ctype == self._ctype)
+
+    def __len__(self):
+        return 2
+
+class CarrierData(Mapping):
+    """Energy data series of an energy carrier stored in a single array
+
+    numsteps is the number of timesteps, offsets the position of each
+    series (following SERIES) in values, or None for zero series.
+    """
+    __slots__ = ('numsteps', 'offsets', 'values')
+
+    def __init__(self, numsteps, offsets, values):
+        self.numsteps = numsteps
+        self.offsets = tuple(offsets)
+        self.values = values
+
+    @classmethod
+    def fromdict(cls, vdata, numsteps):
+        """Compact record from carrier data indexed by ctype and originoruse
+
+        Missing series, or series set to None, are taken as zero series.
+        """
+        values = array('d')
+        offsets = []
+        for (ctype, originoruse) in SERIES:
+            series = vdata.get(ctype, {}).get(originoruse)
+            if series is None or not any(series):
+                offsets.append(None)
+                continue
+            if len(series) != numsteps:
+                raise ValueError("All input must have the same number of timesteps (%i), found %i"
+                                 % (numsteps, len(series)))
+            offsets.append(len(values))
+            values.extend(series)
+        return cls(numsteps, offsets, values)
+
+    def series(self, ctype, originoruse):
+        """Values of series for ctype and originoruse, as a memoryview (a copy in Python 2)"""
+        try:
+            offset = self.offsets[SERIES.index((ctype, originoruse))]
+        except ValueError:
+            raise KeyError((ctype, originoruse))
+        if offset is None:
+            return zeroseries(self.numsteps)
+        return _seriesview(self.values, offset, offset + self.numsteps)
+
+    def __getitem__(self, ctype):
+        if ctype not in CTYPES:
+            raise KeyError(ctype)
+        return _CtypeView(self, ctype)
+
+    def __iter__(self):
+        return iter(CTYPES)
+
+    def __len__(self):
+        return len(CTYPES)
+
+    def __reduce__(self):
+        return (self.__class__, (self.numsteps, self.offsets, self.values))
+
+    def todict(self):
+        """Carrier data as nested dicts of lists, as in readenergydata results"""
+        return {ctype: {originoruse: list(self.series(ctype, originoruse))
+                        for originoruse in self[ctype]}
+                for ctype in CTYPES}
+
+def compactenergydata(energydata, numsteps=None):
+    """Energy data with a CarrierData record for each carrier
+
+    energydata has the structure returned by readenergydata. Series can be
+    None (zero series), in which case numsteps must be given if no other
+    series sets it.
+    """
+    if numsteps is None:
+        numsteps = max([len(energydata[carrier][ctype][originoruse])
+                        for carrier in energydata
+                        for ctype in energydata[carrier]
+                        for originoruse in energydata[carrier][ctype]
+                        if energydata[carrier][ctype][originoruse] is not None] or [0])
+    return {carrier: CarrierData.fromdict(energydata[carrier], numsteps) for carrier in energydata}
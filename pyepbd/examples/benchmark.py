@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# 
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Pruebas de rendimiento de pyepbd con datos sintéticos
+
+Genera edificios sintéticos (ver createfiles.edificiosintetico) con
+distinto número de pasos de cálculo, vectores energéticos y edificios, y
+mide por separado el tiempo de las etapas de cálculo:
+
+- parse: lectura de archivos de datos (readenergyfile)
+- components: balance energético (energycomponents)
+- weighting: ponderación de los pasos A y B (weighted_energy_fromcomponents)
+- formatting: formato de los resultados (ep2string y ep2dict)
+
+Los resultados se pueden guardar como referencia en formato JSON y
+compararse con los de ejecuciones posteriores para detectar regresiones:
+
+    $ python pyepbd/examples/benchmark.py --save referencia.json
+    $ python pyepbd/examples/benchmark.py --compare referencia.json
+
+La aceleración del balance energético de una implementación (--backend)
+respecto a la implementación de referencia se muestra con --speedup:
+
+    $ python pyepbd/examples/benchmark.py --backend fused --speedup
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+currpath = os.path.abspath(os.path.dirname(__file__))
+upperpath = os.path.abspath(os.path.join(currpath, '..', '..'))
+sys.path.insert(0, upperpath)
+
+from createfiles import createfile, edificiosintetico
+from pyepbd import __version__, readenergyfile, ep2string, ep2dict, FACTORESDEPASOOFICIALES
+from pyepbd.energycalculations import energycomponents, weighted_energy_fromcomponents, BACKENDS
+from pyepbd.settings import K_EXP, K_RDEL
+
+# Casos de cálculo: (pasos, vectores, edificios)
+CASOS = [(12, 1, 50), (12, 4, 50),
+         (8760, 1, 5), (8760, 4, 5),
+         (35040, 1, 2), (35040, 4, 2)]
+
+ETAPAS = ['parse', 'components', 'weighting', 'formatting']
+
+def nombrecaso(numsteps, numcarriers, numbuildings):
+    return u'%isteps_%icarriers_%ibuildings' % (numsteps, numcarriers, numbuildings)
+
+def crono(func, repeticiones):
+    """Mejor tiempo de repeticiones ejecuciones de func y resultado de la última"""
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = func()
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor, resultado
+
+def ejecutacaso(numsteps, numcarriers, numbuildings, directorio, repeticiones=3, backend='python'):
+    """Tiempos de cada etapa (en segundos) para un caso de cálculo"""
+    nombres = []
+    for ii in range(numbuildings):
+        nombre = os.path.join(directorio, u'edificio_%i_%i_%i.csv' % (numsteps, numcarriers, ii))
+        createfile(nombre, edificiosintetico(numsteps, numcarriers, seed=ii), decimales=4)
+        nombres.append(nombre)
+
+    fp = FACTORESDEPASOOFICIALES
+    tiempos = {}
+    tiempos['parse'], datos = crono(
+        lambda: [readenergyfile(nombre) for nombre in nombres], repeticiones)
+    tiempos['components'], componentes = crono(
+        lambda: [energycomponents(data, K_RDEL, backend) for data in datos], repeticiones)
+    tiempos['weighting'], resultados = crono(
+        lambda: [weighted_energy_fromcomponents(comps, fp, K_EXP) for comps in componentes], repeticiones)
+    tiempos['formatting'], _ = crono(
+        lambda: [(ep2string(EP), ep2dict(EP)) for EP in resultados], repeticiones)
+    return tiempos
+
+def ejecuta(casos=CASOS, repeticiones=3, backend='python', salida=sys.stdout):
+    """Ejecuta los casos de cálculo y devuelve los resultados"""
+    directorio = tempfile.mkdtemp(prefix='pyepbd_bench_')
+    resultados = {'meta': {'pyepbd': __version__,
+                           'python': platform.python_version(),
+                           'platform': platform.platform(),
+                           'backend': backend,
+                           'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                  'cases': {}}
+    try:
+        for caso in casos:
+            tiempos = ejecutacaso(*caso, directorio=directorio, repeticiones=repeticiones, backend=backend)
+            resultados['cases'][nombrecaso(*caso)] = tiempos
+            salida.write(u'%-35s ' % nombrecaso(*caso) +
+                         u' '.join(u'%s=%9.4fs' % (etapa, tiempos[etapa]) for etapa in ETAPAS) + u'\n')
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    return resultados
+
+def compara(resultados, referencia, tolerancia=0.2, umbral=0.005, salida=sys.stdout):
+    """Compara resultados con los de referencia y devuelve el número de regresiones
+
+    Hay regresión cuando el tiempo de una etapa supera al de referencia
+    en más de la fracción tolerancia y en más de umbral segundos (para
+    descartar variaciones en tiempos muy cortos).
+    """
+    regresiones = 0
+    for caso in sorted(resultados['cases']):
+        if caso not in referencia['cases']:
+            continue
+        for etapa in ETAPAS:
+            actual = resultados['cases'][caso][etapa]
+            previo = referencia['cases'][caso].get(etapa)
+            if not previo:
+                continue
+            ratio = actual / previo
+            regresion = ratio > 1.0 + tolerancia and actual - previo > umbral
+            regresiones += regresion
+            salida.write(u'%-35s %-10s %9.4fs -> %9.4fs (x%.2f)%s\n' % (
+                caso, etapa, previo, actual, ratio, u'  REGRESIÓN' if regresion else u''))
+    return regresiones
+
+def aceleracion(resultados, referencia, etapa='components', salida=sys.stdout):
+    """Muestra la aceleración de una etapa respecto a los resultados de referencia"""
+    backend, backendref = resultados['meta']['backend'], referencia['meta']['backend']
+    for caso in sorted(resultados['cases']):
+        actual = resultados['cases'][caso][etapa]
+        previo = referencia['cases'][caso][etapa]
+        salida.write(u'%-35s %-10s %s=%9.4fs %s=%9.4fs (x%.2f)\n' % (
+            caso, etapa, backendref, previo, backend, actual, previo / actual))
+
+def main():
+    parser = argparse.ArgumentParser(description=u'Pruebas de rendimiento de pyepbd')
+    parser.add_argument('--save', dest='save', default=None,
+                        help=u'guarda los resultados en este archivo JSON')
+    parser.add_argument('--compare', dest='compare', default=None,
+                        help=u'compara los resultados con los de este archivo JSON')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.2,
+                        help=u'aumento relativo de tiempo admitido antes de señalar una regresión')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.005,
+                        help=u'aumento absoluto de tiempo (s) admitido antes de señalar una regresión')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help=u'repeticiones de cada medida (se usa la mejor)')
+    parser.add_argument('--steps', dest='steps', type=int, nargs='+', default=None,
+                        help=u'limita los casos a estos números de pasos')
+    parser.add_argument('--backend', dest='backend', choices=BACKENDS, default='python',
+                        help=u'implementación del balance energético')
+    parser.add_argument('--speedup', dest='speedup', action='store_true',
+                        help=u'muestra la aceleración del balance energético respecto a la implementación python')
+    args = parser.parse_args()
+
+    casos = [caso for caso in CASOS if args.steps is None or caso[0] in args.steps]
+    resultados = ejecuta(casos, args.repeat, args.backend)
+    if args.speedup:
+        aceleracion(resultados, ejecuta(casos, args.repeat, 'python'))
+
+    if args.save:
+        with io.open(args.save, 'w', encoding='utf-8') as ff:
+            ff.write(json.dumps(resultados, indent=2, sort_keys=True))
+    if args.compare:
+        with io.open(args.compare, 'r', encoding='utf-8') as ff:
+            referencia = json.load(ff)
+        if compara(resultados, referencia, args.tolerance, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
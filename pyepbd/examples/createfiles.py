@@ -38,19 +38,77 @@ VALIDCARRIERS = [u'ELECTRICIDAD', u'ELECTRICIDADCANARIAS', u'ELECTRICIDADBALEARE
 VALIDCTYPES = [u'CONSUMO', u'PRODUCCION']
 VALID_ORIGINORUSE = [u'EPB', u'NEPB', u'INSITU', u'COGENERACION']
 
-def perfilC(valortotal):
+# Días de cada mes (año no bisiesto)
+DIASMES = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# Perfiles diarios horarios (valores relativos de cada hora del día)
+PERFILDIARIO_C = [0.6, 0.5, 0.5, 0.5, 0.5, 0.6, 0.8, 1.2, 1.4, 1.3, 1.2, 1.2,
+                  1.3, 1.3, 1.2, 1.1, 1.1, 1.2, 1.4, 1.5, 1.4, 1.2, 0.9, 0.7]
+PERFILDIARIO_P1 = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.1, 0.3, 0.6, 0.8, 0.95, 1.0,
+                   1.0, 0.95, 0.8, 0.6, 0.3, 0.1, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+PERFILDIARIO_P2 = [0.3, 0.3, 0.3, 0.3, 0.3, 0.4, 0.7, 1.0, 1.0, 1.0, 1.0, 1.0,
+                   1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.9, 0.7, 0.5, 0.4]
+
+# Número de pasos de cálculo admitidos: mensual, horario y cuartohorario
+NUMPASOS = [12, 8760, 35040]
+
+def expandeperfil(perfilmensual, numsteps, perfildiario):
+    """Distribuye un perfil mensual en numsteps pasos de cálculo
+
+    Los valores de cada mes se reparten entre sus días y, dentro de cada
+    día, según el perfil diario horario. El total anual se conserva.
+    """
+    if numsteps == 12:
+        return perfilmensual
+    if numsteps not in NUMPASOS:
+        raise ValueError(u'Número de pasos no admitido: %i. Valores admitidos: %s' % (numsteps, NUMPASOS))
+    pasoshora = numsteps // (365 * 24)
+    diario = np.repeat(np.array(perfildiario, dtype=float), pasoshora)
+    diario = diario / diario.sum()
+    return np.concatenate([np.tile(diario * valormes / dias, dias)
+                           for valormes, dias in zip(perfilmensual, DIASMES)])
+
+def perfilC(valortotal, numsteps=12):
     perfil = np.array([0.1639344262, 0.1311475410, 0.0819672131, 0.0737704918, 0.0409836066, 0.0491803279, 0.0655737705, 0.0573770492, 0.0409836066, 0.0655737705, 0.0983606557, 0.1311475410])
-    return float(valortotal) * perfil
+    return float(valortotal) * expandeperfil(perfil, numsteps, PERFILDIARIO_C)
 
-def perfilP1(valortotal):
+def perfilP1(valortotal, numsteps=12):
     perfil = np.array([0.0283687943, 0.0354609929, 0.0496453901, 0.0709219858, 0.12056737590, 0.134751773, 0.1418439716, 0.1276595745, 0.1134751773, 0.0851063830, 0.0567375887, 0.0354609929])
-    return float(valortotal) * perfil
+    return float(valortotal) * expandeperfil(perfil, numsteps, PERFILDIARIO_P1)
 
-def perfilP2(valortotal):
+def perfilP2(valortotal, numsteps=12):
     perfil = np.array([0.0851063830, 0.0567375887, 0.0354609929, 0.0283687943, 0.0354609929, 0.0496453901, 0.0709219858, 0.1205673759, 0.1347517730, 0.1418439716, 0.1276595745, 0.1134751773])
-    return float(valortotal) * perfil
-
-def createfile(nombre_fichero, data):
+    return float(valortotal) * expandeperfil(perfil, numsteps, PERFILDIARIO_P2)
+
+# Vectores de consumo (combustibles) para edificios sintéticos, además de ELECTRICIDAD
+COMBUSTIBLES = [u'GASNATURAL', u'GASOLEO', u'GLP', u'BIOMASA', u'CARBON',
+                u'BIOMASADENSIFICADA', u'FUELOIL', u'BIOCARBURANTE']
+
+def edificiosintetico(numsteps=12, numcarriers=2, seed=None):
+    """Datos de un edificio sintético con numsteps pasos y numcarriers vectores
+
+    El edificio tiene consumos eléctricos EPB y no EPB, producción
+    fotovoltaica (perfil P1), cogeneración (perfil P2) si numcarriers > 2
+    y consumos de numcarriers - 1 combustibles, con valores anuales
+    aleatorios (reproducibles con seed).
+
+    Devuelve una lista de (vector, tipo, src_dst, valores) como la que usa
+    createfile.
+    """
+    if not 1 <= numcarriers <= len(COMBUSTIBLES) + 1:
+        raise ValueError(u'Número de vectores no admitido: %i' % numcarriers)
+    rng = np.random.RandomState(seed)
+    data = [(u'ELECTRICIDAD', u'CONSUMO', u'EPB', perfilC(rng.uniform(50, 150), numsteps)),
+            (u'ELECTRICIDAD', u'CONSUMO', u'NEPB', perfilC(rng.uniform(10, 30), numsteps)),
+            (u'ELECTRICIDAD', u'PRODUCCION', u'INSITU', perfilP1(rng.uniform(20, 120), numsteps))]
+    if numcarriers > 2:
+        data.append((u'ELECTRICIDAD', u'PRODUCCION', u'COGENERACION', perfilP2(rng.uniform(10, 40), numsteps)))
+    for carrier in COMBUSTIBLES[:numcarriers - 1]:
+        data.append((carrier, u'CONSUMO', u'EPB', perfilC(rng.uniform(50, 200), numsteps)))
+    return data
+
+def createfile(nombre_fichero, data, decimales=2):
+    formato = u'%%.%if' % decimales
     with open(nombre_fichero, 'w') as f:
         f.writelines(u'vector,tipo,src_dst\n')
         if data is not None:
@@ -64,7 +122,7 @@ def createfile(nombre_fichero, data):
                     print(u'__error__ no reconozco a %s como fuente/destino, no está en la lista' % originoruse, VALID_ORIGINORUSE)
                 if isinstance(values, int):
                     values = [values]
-                datalines.append(u'%s,%s,%s,' % (carrier, ctype, originoruse) + ','.join(['%.2f' % e for e in values]) + '\n')
+                datalines.append(u'%s,%s,%s,' % (carrier, ctype, originoruse) + ','.join([formato % e for e in values]) + '\n')
             f.writelines(datalines)
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Exportación de componentes energéticos por paso de cálculo
+
+Los componentes por paso de cálculo (energycomponents con temporal=True)
+de muchos edificios se calculan y escriben edificio a edificio, de modo que
+la memoria usada no depende del número de edificios, en:
+
+- formato binario por columnas (una serie contigua por vector, fuente y
+  uso), que puede leerse de nuevo con binaryio.readcomponentsbinary usando
+  memoria mapeada.
+- formato CSV, con una fila por vector, fuente, uso y paso de cálculo:
+
+    id,vector,fuente,uso,paso,valor
+    edificio1,ELECTRICIDAD,grid,input,0,9.67
+    ...
+
+  Las filas se escriben en bloques de chunksize filas.
+"""
+
+import csv
+import io
+import sys
+
+from .settings import K_RDEL
+from .energycalculations import energycomponents
+from .binaryio import BinaryWriter, COMPONENTSMAGIC
+
+CSVFIELDS = ['id', 'vector', 'fuente', 'uso', 'paso', 'valor']
+
+if sys.version_info[0] < 3: # Python 2 csv writes encoded bytes
+    def _csvopen(filename):
+        return open(filename, 'wb')
+
+    def _csvtext(value):
+        return (u'%s' % value).encode('utf-8')
+else:
+    def _csvopen(filename):
+        return io.open(filename, 'w', encoding='utf-8', newline='')
+
+    def _csvtext(value):
+        return value
+
+class ComponentsCSVWriter(object):
+    """Writer of timestep components of buildings to filename in CSV format"""
+
+    def __init__(self, filename, chunksize=10000):
+        self.chunksize = chunksize
+        self._file = _csvopen(filename)
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._writer.writerow(CSVFIELDS)
+
+    def write(self, buildingid, components_t):
+        """Write timestep components of building buildingid
+
+        components_t is a dict of carrier -> source -> use -> series.
+        """
+        chunk = []
+        for carrier in sorted(components_t):
+            for source in sorted(components_t[carrier]):
+                for use in sorted(components_t[carrier][source]):
+                    prefix = tuple(_csvtext(key) for key in (buildingid, carrier, source, use))
+                    for step, value in enumerate(components_t[carrier][source][use]):
+                        chunk.append(prefix + (step, float(value)))
+                        if len(chunk) >= self.chunksize:
+                            self._writer.writerows(chunk)
+                            chunk = []
+        self._writer.writerows(chunk)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def exportcomponents(buildings, k_rdel=K_RDEL, binfilename=None, csvfilename=None,
+                     backend='fused', chunksize=10000):
+    """Compute and export timestep components of buildings
+
+    buildings is an iterable of (id, energydata) pairs (e.g. an
+    EnergyBinaryFile). Components of each building are computed with
+    energycomponents (temporal=True) and written to binfilename (binary
+    format) and/or csvfilename (CSV format) before computing the next one.
+
+    Returns the number of exported buildings.
+    """
+    if binfilename is None and csvfilename is None:
+        raise ValueError("No output file for exported components")
+    writers = []
+    try:
+        if binfilename is not None:
+            writers.append(BinaryWriter(binfilename, COMPONENTSMAGIC))
+        if csvfilename is not None:
+            writers.append(ComponentsCSVWriter(csvfilename, chunksize))
+        numbuildings = 0
+        for buildingid, energydata in buildings:
+            components = energycomponents(energydata, k_rdel, backend, temporal=True)
+            components_t = {carrier: components[carrier]['temporal'] for carrier in components}
+            for writer in writers:
+                writer.write(buildingid, components_t)
+            numbuildings += 1
+    finally:
+        for writer in writers:
+            writer.close()
+    return numbuildings
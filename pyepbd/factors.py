@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Tablas de factores de paso
+
+Los factores de paso se manejan como listas de diccionarios con las claves
+'vector', 'fuente', 'uso', 'step', 'ren' y 'nren'. La clase FactorTable
+mantiene esa interfaz de lista y añade índices para localizar cada factor
+en tiempo constante, evitando recorrer la lista completa en cada consulta.
+"""
+
+class FactorTable(list):
+    """List of weighting factors indexed by carrier, source, use and step
+
+    This behaves as the list of weighting factor dicts used elsewhere, so it
+    can be used in place of it, but lookups by (vector, fuente, uso, step)
+    are done through an index built once when the table is created.
+
+    Tables are not meant to be modified after creation. Build a new table
+    to change its contents.
+
+    When several factors share the same key, the first one is used, as done
+    by the list filtering lookups.
+    """
+
+    def __init__(self, factors=(), vector=None):
+        list.__init__(self, factors)
+        # Carrier of the table, if it was restricted to a single carrier
+        self.vector = vector
+        self._index = {}
+        self._sourceindex = {}
+        self._bycarrier = {}
+        for fpi in self:
+            self._index.setdefault((fpi['vector'], fpi['fuente'], fpi['uso'], fpi['step']), fpi)
+            self._sourceindex.setdefault((fpi['fuente'], fpi['uso'], fpi['step']), fpi)
+
+    def factor(self, vector, fuente, uso, step):
+        """Weighting factor for vector, fuente, uso and step, or None if it's not defined"""
+        return self._index.get((vector, fuente, uso, step))
+
+    def sourcefactor(self, fuente, uso, step):
+        """Weighting factor for fuente, uso and step
+
+        This is meant for tables restricted to a single carrier (see
+        forcarrier). Raises ValueError if there's no matching factor.
+        """
+        try:
+            return self._sourceindex[(fuente, uso, step)]
+        except KeyError:
+            raise ValueError("Weighting factor not found for carrier '%s', source '%s', "
+                             "use '%s' and step '%s'" % (self.vector, fuente, uso, step))
+
+    def forcarrier(self, vector):
+        """Table restricted to the weighting factors of the vector carrier
+
+        Restricted tables are built once and reused in later calls.
+        """
+        if vector not in self._bycarrier:
+            self._bycarrier[vector] = FactorTable([fpi for fpi in self if fpi['vector'] == vector], vector)
+        return self._bycarrier[vector]
+
+def asfactortable(fp):
+    """Return fp as a FactorTable, building it only if fp is a plain list"""
+    if isinstance(fp, FactorTable):
+        return fp
+    return FactorTable(fp)
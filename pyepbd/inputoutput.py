@@ -27,14 +27,43 @@
 # TODO: handle exceptions in CLI
 
 import io
+from array import array
+from operator import add
 from .utils import *
+from .factors import FactorTable
+from .energydata import compactenergydata
+from .profiling import profiled, resultsize
 
-def readenergydata(datalist):
+def _addenergyvalues(energydata, carrier, ctype, originoruse, values):
+    """Accumulate values (array of floats) in energydata[carrier][ctype][originoruse]
+
+    Series of new carriers are left empty (None) until values are added
+    to them (see _fillzeros), so that the first values are stored without
+    copies. Later values are added elementwise without intermediate lists.
+    """
+    if carrier not in energydata:
+        energydata[carrier] = {'CONSUMO': {'EPB': None, 'NEPB': None},
+                               'PRODUCCION': {'INSITU': None, 'COGENERACION': None}}
+    series = energydata[carrier][ctype]
+    current = series[originoruse]
+    series[originoruse] = values if current is None else array('d', map(add, current, values))
+
+def _fillzeros(energydata, numsteps):
+    """Set series in energydata to lists of floats, and missing ones to zero series of length numsteps"""
+    for carrier in energydata:
+        for ctype in energydata[carrier]:
+            series = energydata[carrier][ctype]
+            for originoruse in series:
+                values = series[originoruse]
+                series[originoruse] = [0.0] * numsteps if values is None else values.tolist()
+    return energydata
+
+def readenergydata(datalist, compact=False):
     """Read input data from list and return data structure
 
     Returns dict of array of values indexed by carrier, ctype and originoruse
 
-    data[carrier][ctype][originoruse] -> values as np.array with length=numsteps
+    data[carrier][ctype][originoruse] -> values as list of floats with length=numsteps
 
     * carrier is an energy carrier
     * ctype is either 'PRODUCCION' or 'CONSUMO' por produced or used energy
@@ -49,6 +78,9 @@ def readenergydata(datalist):
       {'carrier': carrier2, 'ctype': ctype2, 'originoruse': originoruse2, 'values': values2},
       ...
     ]
+
+    With compact, carrier data are CarrierData records (see energydata),
+    where zero series are not stored.
     """
     numsteps = max(len(data['values']) for data in datalist)
 
@@ -57,27 +89,22 @@ def readenergydata(datalist):
         carrier = data['carrier']
         ctype = data['ctype']
         originoruse = data['originoruse']
-        values = [float(value) for value in data['values']]
+        values = array('d', map(float, data['values']))
 
         if len(values) != numsteps:
             raise ValueError("All input must have the same number of timesteps. "
                              "Problem found in line %i:\n\t%s" % (ii+1, data))
 
-        if carrier not in energydata:
-            energydata[carrier] = {'CONSUMO': {'EPB': [0.0] * numsteps,
-                                                  'NEPB': [0.0] * numsteps},
-                                   'PRODUCCION': {'INSITU': [0.0] * numsteps,
-                                                  'COGENERACION': [0.0] * numsteps}}
+        _addenergyvalues(energydata, carrier, ctype, originoruse, values)
+    return _finishenergydata(energydata, numsteps, compact)
 
-        energydata[carrier][ctype][originoruse] = vecvecsum(energydata[carrier][ctype][originoruse], values)
-    return energydata
-
-def readenergyfile(filename):
+@profiled('readenergyfile', resultsize)
+def readenergyfile(filename, compact=False):
     """Read input data from filename and return data structure
 
     Returns dict of array of values indexed by carrier, ctype and originoruse
 
-    data[carrier][ctype][originoruse] -> values as np.array with length=numsteps
+    data[carrier][ctype][originoruse] -> values as list of floats with length=numsteps
 
     * carrier is an energy carrier
     * ctype is either 'PRODUCCION' or 'CONSUMO' por produced or used energy
@@ -85,27 +112,100 @@ def readenergyfile(filename):
       - the energy origin for produced energy (INSITU or COGENERACION)
       - the energy end use (EPB or NEPB) for delivered energy
     * values
+
+    The file is read line by line, and values are parsed and accumulated
+    as they are read, so that memory use is bounded by the data size.
+
+    With compact, carrier data are CarrierData records (see energydata),
+    where zero series are not stored.
     """
+    numsteps = None
+    energydata = {}
     with io.open(filename, 'r') as datafile:
-        datalines = []
         for ii, line in enumerate(datafile):
-            if line.startswith('vector') or line.startswith('#'):
+            if line.startswith('vector') or line.startswith('#') or not line.strip():
+                continue
+            carrier, ctype, originoruse, values = _parseline(line.strip().split(','), ii+1, line)
+            if numsteps is None:
+                numsteps = len(values)
+            elif len(values) != numsteps:
+                raise ValueError("All input must have the same number of timesteps. "
+                                 "Problem found in line %i:\n\t%s" % (ii+1, line))
+
+            _addenergyvalues(energydata, carrier, ctype, originoruse, values)
+    return _finishenergydata(energydata, numsteps or 0, compact)
+
+def _parseline(fields, lineno, line):
+    """Parse fields of line number lineno of an energy data file as (carrier, ctype, originoruse, values)"""
+    carrier, ctype, originoruse = fields[0:3]
+
+    if ctype not in ('PRODUCCION', 'CONSUMO'):
+        raise ValueError("Carrier type is not 'CONSUMO' or 'PRODUCCION' in line %i\n\t%s" % (lineno, line))
+    if originoruse not in ('EPB', 'NEPB', 'INSITU', 'COGENERACION'):
+        raise ValueError(("Origin or end use is not 'EPB', 'NEPB', 'INSITU' or 'COGENERACION'"
+                          " in line %i\n\t%s" % (lineno, line)))
+
+    return carrier, ctype, originoruse, array('d', map(float, fields[3:]))
+
+def _finishenergydata(energydata, numsteps, compact):
+    """Energy data as lists with zero series filled in, or as compact records"""
+    if compact:
+        return compactenergydata(energydata, numsteps)
+    return _fillzeros(energydata, numsteps)
+
+def readbuildingsfile(filename, compact=False):
+    """Read energy data of several buildings from filename, one building at a time
+
+    The file has the format of energy data files (see readenergyfile) with
+    a leading building id column:
+
+    id,vector,tipo,src_dst
+    edificio1,ELECTRICIDAD,CONSUMO,EPB,16.39,13.11,...
+    edificio1,ELECTRICIDAD,PRODUCCION,INSITU,8.13,8.42,...
+    edificio2,ELECTRICIDAD,CONSUMO,EPB,...
+
+    All lines of a building must be consecutive. Buildings can have
+    different numbers of timesteps.
+
+    This is a generator that yields (id, energydata) pairs, with energydata
+    as returned by readenergyfile (or readenergydata), in file order. Only
+    the data of the building being read is kept in memory.
+    """
+    seen = set()
+    buildingid = None
+    numsteps = None
+    energydata = {}
+    with io.open(filename, 'r') as datafile:
+        for ii, line in enumerate(datafile):
+            if line.startswith('id,') or line.startswith('#') or not line.strip():
                 continue
             fields = line.strip().split(',')
-            carrier, ctype, originoruse = fields[0:3]
-            values = fields[3:]
-
-            if ctype not in ('PRODUCCION', 'CONSUMO'):
-                raise ValueError("Carrier type is not 'CONSUMO' or 'PRODUCCION' in line %i\n\t%s" % (ii+2, line))
-            if originoruse not in ('EPB', 'NEPB', 'INSITU', 'COGENERACION'):
-                raise ValueError(("Origin or end use is not 'EPB', 'NEPB', 'INSITU' or 'COGENERACION'"
-                                  " in line %i\n\t%s" % (ii+2, line)))
-
-            datalines.append({"carrier": carrier, "ctype": ctype, "originoruse": originoruse, "values": values})
-    return readenergydata(datalines)
-
+            if fields[0] != buildingid:
+                if buildingid is not None:
+                    yield buildingid, _finishenergydata(energydata, numsteps, compact)
+                buildingid = fields[0]
+                if buildingid in seen:
+                    raise ValueError("Lines of building '%s' are not consecutive. "
+                                     "Problem found in line %i:\n\t%s" % (buildingid, ii+1, line))
+                seen.add(buildingid)
+                numsteps = None
+                energydata = {}
+            carrier, ctype, originoruse, values = _parseline(fields[1:], ii+1, line)
+            if numsteps is None:
+                numsteps = len(values)
+            elif len(values) != numsteps:
+                raise ValueError("All input of building '%s' must have the same number of timesteps. "
+                                 "Problem found in line %i:\n\t%s" % (buildingid, ii+1, line))
+            _addenergyvalues(energydata, carrier, ctype, originoruse, values)
+    if buildingid is not None:
+        yield buildingid, _finishenergydata(energydata, numsteps, compact)
+
+@profiled('readfactors')
 def readfactors(filename):
-    """Read energy weighting factors data from file"""
+    """Read energy weighting factors data from file
+
+    Returns a FactorTable that can be reused in later calculations.
+    """
     # TODO: check valid sources
     data = []
     with io.open(filename, 'r') as ff:
@@ -121,7 +221,7 @@ def readfactors(filename):
             except:
                 raise ValueError(u"Número o tipo incorrecto de datos en campos de línea %i: %s" % (ii, line))
             data.append({'vector': vector, 'fuente': fuente, 'uso': uso, 'step': step, 'ren': fren, 'nren': fnren})
-    return data
+    return FactorTable(data)
 
 def readfactorsdata(data):
     """Read weighting factors from data object
@@ -135,11 +235,14 @@ def readfactorsdata(data):
     - step is the calculation step as string (A|B)
     - ren is the factor value for its renewable share (e.g. 0.008)
     - nren is the factor value for its non-renewable share (e.g. 2.500)
+
+    Returns a FactorTable.
     """
     #TODO: no validation done here
-    return [{'vector': vector, 'fuente': fuente, 'uso': uso, 'step': step, 'ren': fren, 'nren': fnren}
-            for (vector, fuente, uso, step, fren, fnren) in data]
+    return FactorTable({'vector': vector, 'fuente': fuente, 'uso': uso, 'step': step, 'ren': fren, 'nren': fnren}
+                       for (vector, fuente, uso, step, fren, fnren) in data)
 
+@profiled('ep2string')
 def ep2string(EP, area=1.0):
     """Format energy efficiency indicators as string from primary energy data
 
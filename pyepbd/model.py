@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Modelo energético incremental de un edificio
+
+EnergyModel guarda los datos energéticos de un edificio por vector energético,
+junto con sus componentes energéticos (temporales y anuales) y su energía
+ponderada. Al modificar los datos de un vector solo se recalcula ese vector,
+y los indicadores totales se obtienen sumando las contribuciones guardadas:
+
+    >>> model = EnergyModel(readenergyfile('datos.csv'), readfactors('factores.csv'))
+    >>> model.weighted_energy()
+    >>> model.setseries('ELECTRICIDAD', 'PRODUCCION', 'INSITU', nuevaproduccion)
+    >>> model.weighted_energy() # solo se recalcula ELECTRICIDAD
+
+Cambiar k_rdel obliga a recalcular los componentes de todos los vectores, y
+cambiar los factores de paso o k_exp solo su ponderación.
+"""
+
+from array import array
+from .settings import FACTORESDEPASOOFICIALES, K_RDEL, K_EXP
+from .factors import asfactortable
+from .energycalculations import backendfunction, weighted_energy_forcarrier
+
+CTYPES = {'CONSUMO': ['EPB', 'NEPB'], 'PRODUCCION': ['INSITU', 'COGENERACION']}
+
+class EnergyModel(object):
+    """Energy data of a building with per carrier cached results
+
+    energydata has the structure returned by readenergydata. Energy
+    components and weighted energy are computed on demand and kept by
+    carrier until that carrier's data or the calculation parameters change.
+    """
+
+    def __init__(self, energydata=None, fp=FACTORESDEPASOOFICIALES, k_rdel=K_RDEL, k_exp=K_EXP, backend='python'):
+        self._forcarrier = backendfunction(backend)
+        self.backend = backend
+        self._fp = asfactortable(fp)
+        self._k_rdel = k_rdel
+        self._k_exp = k_exp
+        self._energydata = {}
+        self._components = {}
+        self._weighted = {}
+        self.numsteps = None
+        for carrier in (energydata or {}):
+            self.setcarrier(carrier, energydata[carrier])
+
+    # Energy data
+
+    @property
+    def carriers(self):
+        return list(self._energydata)
+
+    def carrierdata(self, carrier):
+        """Energy data of carrier, as [ctype][originoruse] -> values"""
+        return self._energydata[carrier]
+
+    def _checknumsteps(self, values, numsteps):
+        if numsteps is not None and len(values) != numsteps:
+            raise ValueError("All input must have the same number of timesteps (%i), found %i"
+                             % (numsteps, len(values)))
+
+    def _othernumsteps(self, carrier):
+        """Number of timesteps of carriers other than carrier (None if there are none)"""
+        for other in self._energydata:
+            if other != carrier:
+                return len(self._energydata[other]['CONSUMO']['EPB'])
+        return None
+
+    def _invalidate(self, carrier):
+        self._components.pop(carrier, None)
+        self._weighted.pop(carrier, None)
+
+    def setcarrier(self, carrier, vdata):
+        """Set (or replace) all energy data of carrier
+
+        vdata is indexed by ctype and originoruse, as readenergydata
+        results for a carrier. Missing series are set to zero.
+
+        The model is left unchanged if vdata is rejected.
+        """
+        numsteps = self._othernumsteps(carrier)
+        for ctype in vdata:
+            for originoruse in vdata[ctype]:
+                if originoruse not in CTYPES.get(ctype, ()):
+                    raise ValueError("Unknown energy data series '%s, %s'" % (ctype, originoruse))
+                values = vdata[ctype][originoruse]
+                self._checknumsteps(values, numsteps)
+                numsteps = len(values)
+        if numsteps is None:
+            raise ValueError("No energy data series for carrier '%s'" % carrier)
+        zeros = array('d', [0.0]) * numsteps
+        self._energydata[carrier] = {ctype: {originoruse: vdata.get(ctype, {}).get(originoruse, zeros)
+                                             for originoruse in CTYPES[ctype]}
+                                     for ctype in CTYPES}
+        self.numsteps = numsteps
+        self._invalidate(carrier)
+
+    def setseries(self, carrier, ctype, originoruse, values):
+        """Set energy data series of carrier for ctype and originoruse"""
+        if carrier not in self._energydata:
+            self.setcarrier(carrier, {ctype: {originoruse: values}})
+            return
+        if originoruse not in CTYPES.get(ctype, ()):
+            raise ValueError("Unknown energy data series '%s, %s'" % (ctype, originoruse))
+        self._checknumsteps(values, self.numsteps)
+        self._energydata[carrier][ctype][originoruse] = values
+        self._invalidate(carrier)
+
+    def removecarrier(self, carrier):
+        """Remove energy carrier and all its data"""
+        del self._energydata[carrier]
+        self._invalidate(carrier)
+        if not self._energydata:
+            self.numsteps = None
+
+    # Calculation parameters
+
+    @property
+    def k_rdel(self):
+        return self._k_rdel
+
+    @k_rdel.setter
+    def k_rdel(self, value):
+        if value != self._k_rdel:
+            self._k_rdel = value
+            self._components.clear()
+            self._weighted.clear()
+
+    @property
+    def k_exp(self):
+        return self._k_exp
+
+    @k_exp.setter
+    def k_exp(self, value):
+        if value != self._k_exp:
+            self._k_exp = value
+            self._weighted.clear()
+
+    @property
+    def fp(self):
+        return self._fp
+
+    @fp.setter
+    def fp(self, value):
+        self._fp = asfactortable(value)
+        self._weighted.clear()
+
+    # Results
+
+    def carriercomponents(self, carrier):
+        """Timestep ('temporal') and annual ('anual') components of carrier"""
+        components = self._components.get(carrier)
+        if components is None:
+            components = self._forcarrier(self._energydata[carrier], self._k_rdel, temporal=True)
+            self._components[carrier] = components
+        return components
+
+    def components(self):
+        """Energy components of all carriers, as returned by energycomponents"""
+        return {carrier: self.carriercomponents(carrier) for carrier in self._energydata}
+
+    def carrierweighted_energy(self, carrier):
+        """Weighted energy of carrier, as returned by weighted_energy_forcarrier"""
+        weighted = self._weighted.get(carrier)
+        if weighted is None:
+            weighted = weighted_energy_forcarrier(self.carriercomponents(carrier)['anual'],
+                                                  self._fp.forcarrier(carrier), self._k_exp)
+            self._weighted[carrier] = weighted
+        return weighted
+
+    def weighted_energy(self):
+        """Total weighted energy of the building, as returned by weighted_energy"""
+        EPA = {'ren': 0.0, 'nren': 0.0}
+        EPB = {'ren': 0.0, 'nren': 0.0}
+        for carrier in self._energydata:
+            EP_cr = self.carrierweighted_energy(carrier)
+            EPA = {'ren': EPA['ren'] + EP_cr['EPpasoA']['ren'], 'nren': EPA['nren'] + EP_cr['EPpasoA']['nren']}
+            EPB = {'ren': EPB['ren'] + EP_cr['EP']['ren'], 'nren': EPB['nren'] + EP_cr['EP']['nren']}
+        return {'EP': EPB, 'EPpasoA': EPA}
@@ -0,0 +1,385 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Cálculo vectorizado del balance energético usando NumPy
+
+Implementación alternativa de las fórmulas 23 a 38 del balance por vector
+energético (EN15603) que opera sobre arrays de NumPy en lugar de listas.
+
+Los resultados coinciden con los de la implementación de referencia en
+Python puro (energycalculations) salvo errores de redondeo.
+
+Las operaciones se realizan sobre el último eje de los arrays, de modo que
+las series pueden tener dimensiones adicionales (p.e. varios edificios).
+"""
+
+from itertools import islice
+
+import numpy as np
+
+from .energycalculations import VALIDORIGINS
+from .energydata import SERIES
+from .factors import asfactortable
+
+def _ratio(num, den):
+    """Elementwise ratio num / den, 0 where den == 0"""
+    num, den = np.broadcast_arrays(num, den)
+    res = np.zeros(num.shape)
+    np.divide(num, den, out=res, where=(den != 0))
+    return res
+
+def balance_t_forcarrier(vdata):
+    """Calculate the time step energy balance of an energy carrier
+
+    This follows the EN15603 procedure for calculation of delivered and
+    exported energy components and mirrors
+    energycalculations.components_t_forcarrier, using ndarrays for the
+    time series (input values can be any sequence).
+
+    Time steps run along the last axis. Annual values keep that axis with
+    length 1 so that they broadcast against the time series.
+
+    The balance doesn't depend on k_rdel, which only affects the delivered
+    energy through the redelivered energy (formula 38). It returns a dict
+    with the time series of produced energy ('E_pr_t_byorigin'), exported
+    energy used for non-EPB uses ('E_exp_used_nEPus_t_byorigin') and
+    exported to the grid ('E_exp_grid_t_byorigin') by origin, and of
+    delivered ('E_del_t') and redelivered ('E_del_rdel_t') energy.
+    """
+
+    # Energy used by technical systems for EPB services, for each time step
+    E_EPus_t = np.asarray(vdata['CONSUMO']['EPB'], dtype=float)
+    # Energy used by technical systems for non-EPB services, for each time step
+    E_nEPus_t = np.asarray(vdata['CONSUMO']['NEPB'], dtype=float)
+
+    # (Electricity) produced on-site and inside the assessment boundary, by origin
+    E_pr_t_byorigin = {origin: np.asarray(vdata['PRODUCCION'][origin], dtype=float)
+                       for origin in VALIDORIGINS}
+    # (Electric) energy produced on-site and inside the assessment boundary, for each time step (formula 23)
+    E_pr_t = sum(E_pr_t_byorigin[origin] for origin in VALIDORIGINS)
+
+    # Produced energy from all origins for EPB services for each time step (formula 24)
+    E_pr_used_EPus_t = np.minimum(E_EPus_t, E_pr_t)
+
+    ## Exported energy for each time step (produced energy not consumed in EPB uses) (formula 25)
+    E_exp_t = E_pr_t - E_pr_used_EPus_t
+
+    # Exported energy by production origin for each time step, weigthing done by produced energy
+    F_exp_t = _ratio(E_exp_t, E_pr_t)
+    E_exp_t_byorigin = {origin: E_pr_t_byorigin[origin] * F_exp_t for origin in VALIDORIGINS}
+
+    # Exported (electric) energy used for non-EPB uses for each time step (formula 26)
+    E_exp_used_nEPus_t = np.minimum(E_exp_t, E_nEPus_t)
+    # Exported energy used for non-EPB services for each time step, by origin, weighting done by exported energy
+    F_exp_used_nEPus_t = _ratio(E_exp_used_nEPus_t, E_exp_t)
+    E_exp_used_nEPus_t_byorigin = {origin: E_exp_t_byorigin[origin] * F_exp_used_nEPus_t for origin in VALIDORIGINS}
+
+    # Exported energy not used for any service for each time step (formula 27)
+    E_exp_nused_t = E_exp_t - E_exp_used_nEPus_t
+    # Exported energy not used for any service for each time step, by origin, weighting done by exported energy
+    F_exp_nused_t = _ratio(E_exp_nused_t, E_exp_t)
+    E_exp_nused_t_byorigin = {origin: E_exp_t_byorigin[origin] * F_exp_nused_t for origin in VALIDORIGINS}
+
+    # Annual exported energy not used for any service (formula 28)
+    E_exp_nused_an = E_exp_nused_t.sum(axis=-1, keepdims=True)
+
+    # Delivered (electric) energy for each time step (formula 29)
+    E_del_t = E_EPus_t - E_pr_used_EPus_t
+    # Annual delivered (electric) energy for EPB uses (formula 30)
+    E_del_an = E_del_t.sum(axis=-1, keepdims=True)
+
+    # Annual temporary exported (electric) energy (formula 31)
+    E_exp_tmp_an = np.minimum(E_exp_nused_an, E_del_an)
+
+    # Redelivered energy for each time step (formula 33)
+    E_del_rdel_t = _ratio(E_exp_tmp_an * E_del_t, E_del_an)
+
+    # Annual exported (electric) energy to the grid (formula 35)
+    E_exp_grid_an = E_exp_nused_an - E_exp_tmp_an
+    # Energy exported to grid, by origin, weighting done by exported and not used energy
+    F_exp_grid_an = _ratio(E_exp_grid_an, E_exp_nused_an)
+    E_exp_grid_t_byorigin = {origin: E_exp_nused_t_byorigin[origin] * F_exp_grid_an for origin in VALIDORIGINS}
+
+    return {'E_pr_t_byorigin': E_pr_t_byorigin,
+            'E_exp_used_nEPus_t_byorigin': E_exp_used_nEPus_t_byorigin,
+            'E_exp_grid_t_byorigin': E_exp_grid_t_byorigin,
+            'E_del_t': E_del_t,
+            'E_del_rdel_t': E_del_rdel_t}
+
+def components_t_forcarrier(vdata, k_rdel):
+    """Calculate energy components for each time step from energy carrier data
+
+    This is the NumPy version of energycalculations.components_t_forcarrier
+    (see balance_t_forcarrier).
+    """
+    balance = balance_t_forcarrier(vdata)
+
+    # Corrected delivered energy for each time step (formula 38)
+    E_del_t_corr = balance['E_del_t'] - k_rdel * balance['E_del_rdel_t']
+
+    components_t = {'grid': {'input': E_del_t_corr}}
+
+    components_t.update({origin: {'input': balance['E_pr_t_byorigin'][origin],
+                                  'to_nEPB': balance['E_exp_used_nEPus_t_byorigin'][origin],
+                                  'to_grid': balance['E_exp_grid_t_byorigin'][origin]} for origin in VALIDORIGINS})
+    return components_t
+
+def components_an_forcarrier(components_t):
+    """Calculate annual energy composition by carrier from time step components
+
+    Values are returned as Python floats, as in the pure Python version.
+    """
+    components_an = {}
+    for origin in components_t: # This is grid + VALIDORIGINS
+        components_an[origin] = {}
+        components_t_byorigin = components_t[origin]
+        for use in components_t_byorigin:
+            sumforuse = float(np.sum(components_t_byorigin[use]))
+            if abs(sumforuse) > 0.1:
+                components_an[origin][use] = sumforuse
+    return components_an
+
+################### Multi-building batch calculation #####################
+
+# Energy series in the series axis of batch arrays follow energydata.SERIES
+
+# Annual energy components (source, use) in the components axis of batch results
+COMPONENTS = [('grid', 'input')] + [(origin, use) for origin in VALIDORIGINS
+                                    for use in ('input', 'to_nEPB', 'to_grid')]
+
+def energydata2array(energydatalist, carriers=None):
+    """Build a dense batch array from a list of energy data dicts
+
+    All buildings must share the same number of time steps.
+
+    Returns (carriers, values), where carriers is the list of energy
+    carriers and values is an array with shape
+    (buildings, carriers, series, timesteps), the series axis following
+    SERIES. Carriers not used by a building are filled with zeros.
+    """
+    energydatalist = list(energydatalist)
+    if carriers is None:
+        carriers = sorted(set(carrier for energydata in energydatalist for carrier in energydata))
+    numsteps = set(len(energydata[carrier][ctype][originoruse])
+                   for energydata in energydatalist
+                   for carrier in energydata
+                   for (ctype, originoruse) in SERIES)
+    if len(numsteps) > 1:
+        raise ValueError("All buildings must have the same number of timesteps. "
+                         "Found: %s" % ', '.join(str(n) for n in sorted(numsteps)))
+    numsteps = numsteps.pop() if numsteps else 0
+
+    values = np.zeros((len(energydatalist), len(carriers), len(SERIES), numsteps))
+    for ii, energydata in enumerate(energydatalist):
+        for jj, carrier in enumerate(carriers):
+            if carrier not in energydata:
+                continue
+            for kk, (ctype, originoruse) in enumerate(SERIES):
+                values[ii, jj, kk] = energydata[carrier][ctype][originoruse]
+    return carriers, values
+
+def batchbalance(values):
+    """Annual energy balance for a batch array of energy data
+
+    values has shape (..., carriers, series, timesteps), with the series
+    axis following SERIES.
+
+    Returns (annual, E_del_rdel_an), where annual is an array with shape
+    (..., carriers, components) of annual components for k_rdel = 0, the
+    components axis following COMPONENTS, and E_del_rdel_an, with shape
+    (..., carriers), is the annual redelivered energy. The delivered grid
+    energy for a given k_rdel is then annual[..., 0] - k_rdel * E_del_rdel_an.
+
+    No significance threshold is applied to these values.
+    """
+    values = np.asarray(values, dtype=float)
+    vdata = {'CONSUMO': {}, 'PRODUCCION': {}}
+    for kk, (ctype, originoruse) in enumerate(SERIES):
+        vdata[ctype][originoruse] = values[..., kk, :]
+    return seriesbalance(vdata)
+
+def seriesbalance(vdata):
+    """Annual energy balance of a carrier from arrays of energy data series
+
+    vdata is indexed by ctype and originoruse, as carrier data in
+    readenergydata results, and its series are arrays that broadcast
+    against each other, with timesteps along the last axis. This allows,
+    e.g., a single consumption series with several production series.
+
+    Returns (annual, E_del_rdel_an), as batchbalance, with the broadcast
+    shape of the series (without the timesteps axis).
+    """
+    shape = np.broadcast(*[vdata[ctype][originoruse] for (ctype, originoruse) in SERIES]).shape[:-1]
+    balance = balance_t_forcarrier(vdata)
+
+    series = {'input': balance['E_pr_t_byorigin'],
+              'to_nEPB': balance['E_exp_used_nEPus_t_byorigin'],
+              'to_grid': balance['E_exp_grid_t_byorigin']}
+    annual = np.empty(shape + (len(COMPONENTS),))
+    for kk, (source, use) in enumerate(COMPONENTS):
+        if source == 'grid':
+            annual[..., kk] = balance['E_del_t'].sum(axis=-1)
+        else:
+            annual[..., kk] = series[use][source].sum(axis=-1)
+    return annual, np.broadcast_to(balance['E_del_rdel_t'].sum(axis=-1), shape).copy()
+
+def significant(annual):
+    """Set annual components below the significance threshold to zero
+
+    This is the same threshold used by components_an_forcarrier.
+    """
+    annual[np.abs(annual) <= 0.1] = 0.0
+    return annual
+
+def batchcomponents(values, k_rdel):
+    """Annual energy components for a batch array of energy data
+
+    values has shape (..., carriers, series, timesteps), with the series
+    axis following SERIES.
+
+    Returns an array with shape (..., carriers, components), the
+    components axis following COMPONENTS. As in components_an_forcarrier,
+    components with an annual value below the significance threshold are
+    set to zero.
+    """
+    annual, E_del_rdel_an = batchbalance(values)
+    # Corrected delivered energy (formula 38)
+    annual[..., 0] -= k_rdel * E_del_rdel_an
+    return significant(annual)
+
+def weightingcoefs(fp, carriers, k_exp):
+    """Weighting coefficients for the annual components of carriers
+
+    Returns (coefsA, coefsAB), arrays with shape (2, carriers, components)
+    holding the ren (index 0) and nren (index 1) coefficients that give the
+    step A and step A+B weighted energy as a sum of annual components
+    times coefficients. The components axis follows COMPONENTS.
+
+    Coefficients for undefined weighting factors are NaN.
+    """
+    fp = asfactortable(fp)
+
+    nan = float('nan')
+    def factorvalues(carrier, source, use, step):
+        fpi = fp.factor(carrier, source, use, step)
+        return (fpi['ren'], fpi['nren']) if fpi is not None else (nan, nan)
+
+    coefsA = np.empty((2, len(carriers), len(COMPONENTS)))
+    coefsAB = np.empty((2, len(carriers), len(COMPONENTS)))
+    for jj, carrier in enumerate(carriers):
+        for kk, (source, use) in enumerate(COMPONENTS):
+            fpA = np.array(factorvalues(carrier, source, use, 'A'))
+            if use == 'input':
+                coefsA[:, jj, kk] = fpA
+                coefsAB[:, jj, kk] = fpA
+            else:
+                fpB = np.array(factorvalues(carrier, source, use, 'B'))
+                coefsA[:, jj, kk] = -fpA
+                coefsAB[:, jj, kk] = -fpA - k_exp * (fpB - fpA)
+    return coefsA, coefsAB
+
+def weightcomponents(annual, coefs, carriers):
+    """Weighted energy from annual components and weighting coefficients
+
+    annual has shape (..., carriers, components) (see batchcomponents) and
+    coefs has shape (2, carriers, components) (see weightingcoefs).
+
+    Returns the (ren, nren) arrays with shape annual.shape[:-2].
+
+    Raises ValueError if a non-zero component lacks its weighting factor.
+    """
+    missing = np.isnan(coefs[0]) | np.isnan(coefs[1])
+    used = np.any(annual != 0, axis=tuple(range(annual.ndim - 2)))
+    if np.any(missing & used):
+        raise ValueError("Weighting factors not found for: %s" % ', '.join(
+            "(%s, %s, %s)" % (carriers[jj], COMPONENTS[kk][0], COMPONENTS[kk][1])
+            for (jj, kk) in zip(*np.nonzero(missing & used))))
+    coefs = np.where(missing, 0.0, coefs)
+    ren = np.sum(annual * coefs[0], axis=(-2, -1))
+    nren = np.sum(annual * coefs[1], axis=(-2, -1))
+    return ren, nren
+
+def weighted_energy_batch(values, carriers, fp, k_rdel, k_exp, chunksize=256):
+    """Total weighted energy (step A and A+B) for a batch of buildings
+
+    values has shape (buildings, carriers, series, timesteps), with the
+    series axis following SERIES (see energydata2array), and carriers
+    is the list of carrier names for the carriers axis.
+
+    Buildings are computed in chunks of chunksize buildings to bound the
+    memory used by intermediate arrays.
+
+    Returns a data structure like weighted_energy, whose 'ren' and 'nren'
+    values are arrays with one value per building.
+    """
+    values = np.asarray(values, dtype=float)
+    coefsA, coefsAB = weightingcoefs(fp, carriers, k_exp)
+    numbuildings = values.shape[0]
+    EPA = {'ren': np.zeros(numbuildings), 'nren': np.zeros(numbuildings)}
+    EPB = {'ren': np.zeros(numbuildings), 'nren': np.zeros(numbuildings)}
+    for start in range(0, numbuildings, chunksize):
+        chunk = slice(start, start + chunksize)
+        annual = batchcomponents(values[chunk], k_rdel)
+        EPA['ren'][chunk], EPA['nren'][chunk] = weightcomponents(annual, coefsA, carriers)
+        EPB['ren'][chunk], EPB['nren'][chunk] = weightcomponents(annual, coefsAB, carriers)
+    return {'EP': EPB, 'EPpasoA': EPA}
+
+def weighted_energy_stream(buildings, fp, k_rdel, k_exp, chunksize=256):
+    """Total weighted energy (step A and A+B) for a stream of buildings
+
+    buildings is an iterable of (id, energydata) pairs (e.g. from
+    inputoutput.readbuildingsfile). Buildings are read and computed as
+    batch arrays (see weighted_energy_batch) chunksize buildings at a time,
+    so that memory use is bounded by the chunk size. Buildings of a chunk
+    with different numbers of timesteps are computed in separate batches.
+
+    This is a generator that yields (id, EP) pairs in input order, where EP
+    has the structure returned by weighted_energy.
+    """
+    buildings = iter(buildings)
+    while True:
+        chunk = list(islice(buildings, chunksize))
+        if not chunk:
+            break
+        ids = [buildingid for (buildingid, energydata) in chunk]
+        groups = {}
+        for ii, (buildingid, energydata) in enumerate(chunk):
+            groups.setdefault(_numsteps(energydata), []).append(ii)
+        results = [None] * len(chunk)
+        for positions in groups.values():
+            carriers, values = energydata2array([chunk[ii][1] for ii in positions])
+            EP = weighted_energy_batch(values, carriers, fp, k_rdel, k_exp, chunksize)
+            for jj, ii in enumerate(positions):
+                results[ii] = {key: {part: float(EP[key][part][jj]) for part in ('ren', 'nren')}
+                               for key in ('EP', 'EPpasoA')}
+        del chunk, values
+        for buildingid, EPbuilding in zip(ids, results):
+            yield buildingid, EPbuilding
+
+def _numsteps(energydata):
+    """Number of timesteps of energydata (0 without carriers)"""
+    for carrier in energydata:
+        ctype, originoruse = SERIES[0]
+        return len(energydata[carrier][ctype][originoruse])
+    return 0
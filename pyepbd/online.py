@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Cálculo en línea de la eficiencia energética a partir de datos medidos
+
+OnlineCalculator recibe los datos energéticos por lotes de pasos de cálculo
+(p.e. lecturas de contadores) y mantiene solamente las sumas acumuladas
+necesarias para el balance anual de cada vector energético, sin guardar
+las series completas. En cualquier momento puede obtenerse la energía
+ponderada (pasos A y A+B) de los pasos recibidos hasta entonces:
+
+    >>> calc = OnlineCalculator(fp, k_rdel, k_exp)
+    >>> calc.update({'ELECTRICIDAD': {'CONSUMO': {'EPB': [10.2, 9.8]}}})
+    >>> calc.weighted_energy()
+
+El resultado, una vez recibidos todos los pasos del año, coincide con el de
+weighted_energy salvo errores de redondeo.
+
+El balance de cada paso de cálculo (fórmulas 23 a 27 y 29 de EN15603) solo
+depende de los datos de ese paso y se acumula con annualsums_forcarrier. Los
+términos anuales que dependen de la energía suministrada y exportada de todo
+el año (resuministro, fórmulas 31 a 38) se obtienen de las sumas acumuladas al
+calcular los componentes anuales.
+"""
+
+from .settings import FACTORESDEPASOOFICIALES, K_RDEL, K_EXP
+from .factors import asfactortable
+from .energycalculations import (newannualsums, annualsums_forcarrier, components_an_fromsums,
+                                 weighted_energy_forcarrier)
+
+class OnlineCalculator(object):
+    """Running energy balance from timestep batches of energy data
+
+    Only a fixed number of running sums is kept for each energy carrier,
+    so memory use does not depend on the number of timesteps received.
+    """
+
+    def __init__(self, fp=FACTORESDEPASOOFICIALES, k_rdel=K_RDEL, k_exp=K_EXP):
+        self.fp = asfactortable(fp)
+        self.k_rdel = k_rdel
+        self.k_exp = k_exp
+        self.numsteps = 0
+        self._state = {}
+
+    @property
+    def carriers(self):
+        return list(self._state)
+
+    def update(self, energydata):
+        """Add a batch of timesteps to the running balance
+
+        energydata has the structure returned by readenergydata, with
+        series for the new timesteps only. Missing carriers and series
+        are taken as zero for the batch.
+
+        Returns the number of timesteps received so far.
+        """
+        lengths = set(len(energydata[carrier][ctype][originoruse])
+                      for carrier in energydata
+                      for ctype in energydata[carrier]
+                      for originoruse in energydata[carrier][ctype])
+        if len(lengths) > 1:
+            raise ValueError("All input must have the same number of timesteps. Found: %s"
+                             % ', '.join('%i' % length for length in sorted(lengths)))
+        numsteps = lengths.pop() if lengths else 0
+        for carrier in energydata:
+            if carrier not in self._state:
+                self._state[carrier] = newannualsums()
+            annualsums_forcarrier(energydata[carrier], self._state[carrier])
+        self.numsteps += numsteps
+        return self.numsteps
+
+    def components(self):
+        """Annual components by carrier of timesteps received so far
+
+        Returns carrier -> annual components, as the 'anual' part of
+        energycomponents results.
+        """
+        return {carrier: components_an_fromsums(self._state[carrier], self.k_rdel) for carrier in self._state}
+
+    def weighted_energy(self):
+        """Weighted energy of timesteps received so far, as returned by weighted_energy"""
+        EPA = {'ren': 0.0, 'nren': 0.0}
+        EPB = {'ren': 0.0, 'nren': 0.0}
+        for carrier in self._state:
+            components_an = components_an_fromsums(self._state[carrier], self.k_rdel)
+            EP_cr = weighted_energy_forcarrier(components_an, self.fp.forcarrier(carrier), self.k_exp)
+            EPA = {'ren': EPA['ren'] + EP_cr['EPpasoA']['ren'], 'nren': EPA['nren'] + EP_cr['EPpasoA']['nren']}
+            EPB = {'ren': EPB['ren'] + EP_cr['EP']['ren'], 'nren': EPB['nren'] + EP_cr['EP']['nren']}
+        return {'EP': EPB, 'EPpasoA': EPA}
+
+    def reset(self):
+        """Discard all received data"""
+        self.numsteps = 0
+        self._state = {}
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Componentes energéticos por periodos (meses, estaciones...)
+
+El balance energético se realiza siempre en base anual (EN15603), pero los
+componentes temporales del balance (energycomponents con temporal=True)
+pueden agregarse por periodos de pasos de cálculo consecutivos para obtener
+desgloses mensuales, estacionales, etc.:
+
+    >>> components = energycomponents(data, k_rdel, temporal=True)
+    >>> periodcomponents(components, monthperiods(8760))
+
+Los periodos se definen como rangos (inicio, fin) de índices de pasos de
+cálculo, con fin excluido, como en los slices de Python.
+"""
+
+from .energycalculations import VALIDORIGINS
+
+# Days of each month (non leap year)
+MONTHDAYS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+def monthperiods(numsteps):
+    """Timestep ranges (start, end) of the months of a year of numsteps steps
+
+    numsteps can be 12 (monthly steps) or a multiple of 365 (daily,
+    hourly, quarter-hourly... steps of a non leap year).
+    """
+    if numsteps == 12:
+        stepsbymonth = [1] * 12
+    elif numsteps > 0 and numsteps % 365 == 0:
+        stepsbymonth = [days * numsteps // 365 for days in MONTHDAYS]
+    else:
+        raise ValueError("Can't split %i timesteps in months. Use 12 or a multiple of 365 timesteps" % numsteps)
+    return rangesfromlengths(stepsbymonth)
+
+def rangesfromlengths(lengths):
+    """Consecutive timestep ranges (start, end) with the given numbers of timesteps"""
+    ranges = []
+    start = 0
+    for length in lengths:
+        ranges.append((start, start + length))
+        start += length
+    return ranges
+
+def _checkperiods(periods, numsteps):
+    for (start, end) in periods:
+        if not 0 <= start <= end <= numsteps:
+            raise ValueError("Invalid period (%i, %i) for %i timesteps" % (start, end, numsteps))
+
+def _segmentsums(series, periods):
+    """Sums of series over each period"""
+    try: # ndarray (numpy backend)
+        return [float(series[start:end].sum()) for (start, end) in periods]
+    except AttributeError:
+        return [sum(series[start:end]) for (start, end) in periods]
+
+def periodcomponents_forcarrier(components_t, periods):
+    """Energy components of a carrier for each period from its timestep components
+
+    components_t is the timestep ('temporal') part of energycomponents results.
+
+    Returns a list with the components for each period, with the same
+    structure as the annual components, but keeping all sources and uses
+    (no significance threshold is applied), so that periods covering the
+    whole year add up to the annual values.
+    """
+    numsteps = len(components_t['grid']['input'])
+    _checkperiods(periods, numsteps)
+    byperiod = [{} for _ in periods]
+    for source in ['grid'] + VALIDORIGINS:
+        for use in components_t[source]:
+            for components, value in zip(byperiod, _segmentsums(components_t[source][use], periods)):
+                components.setdefault(source, {})[use] = value
+    return byperiod
+
+def periodcomponents(components, periods):
+    """Energy components by carrier for each period
+
+    components is the result of energycomponents with temporal=True and
+    periods a list of timestep ranges (start, end), e.g. from monthperiods.
+    Returns a dict of carrier -> list of components by period (see
+    periodcomponents_forcarrier).
+    """
+    periods = list(periods)
+    byperiod = {}
+    for carrier in components:
+        if 'temporal' not in components[carrier]:
+            raise ValueError("Timestep components are needed for period components. "
+                             "Use energycomponents with temporal=True")
+        byperiod[carrier] = periodcomponents_forcarrier(components[carrier]['temporal'], periods)
+    return byperiod
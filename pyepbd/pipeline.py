@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Cálculo por lotes en etapas concurrentes con asyncio (Python 3.7+)
+
+Alternativa a batch.runbatch para archivos en unidades de red o discos lentos,
+en la que la lectura de archivos, el cálculo y la escritura de resultados se
+solapan en lugar de alternarse:
+
+- lectura: varios lectores leen y analizan archivos (readenergyfile) a la vez
+- cálculo: los datos leídos pasan por una cola limitada a un grupo de
+  procesos de cálculo (batch.processdata). Cuando la cola se llena, los
+  lectores esperan (contrapresión), de modo que la memoria usada no depende
+  del número de archivos.
+- escritura: los resultados pasan por otra cola limitada y se escriben en
+  un hilo aparte, con el formato de batch.runbatch.
+
+Los resultados se escriben en el orden en el que terminan sus cálculos,
+que no tiene por qué coincidir con el de los archivos de entrada.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .settings import K_EXP, K_RDEL
+from .inputoutput import readenergyfile
+from .batch import initworker, processdata, errorrow, rowwriter
+
+# End of stream mark in queues
+_END = None
+
+def _parse(filename):
+    """(filename, energydata, error) for filename"""
+    try:
+        return filename, readenergyfile(filename), None
+    except Exception as e:
+        return filename, None, e
+
+async def _readstage(filenames, readers, executor, parsed):
+    """Read and parse filenames with readers concurrent readers into parsed queue"""
+    loop = asyncio.get_running_loop()
+    pending = iter(filenames)
+
+    async def reader():
+        for filename in pending:
+            item = await loop.run_in_executor(executor, _parse, filename)
+            await parsed.put(item)
+
+    await asyncio.gather(*[reader() for _ in range(readers)])
+
+async def _computestage(parsed, jobs, pool, results):
+    """Compute parsed data with jobs concurrent calculations into results queue"""
+    loop = asyncio.get_running_loop()
+
+    async def computer():
+        while True:
+            item = await parsed.get()
+            if item is _END:
+                break
+            filename, data, error = item
+            if error is not None:
+                row = errorrow(filename, error)
+            else:
+                row = await loop.run_in_executor(pool, processdata, filename, data)
+            await results.put(row)
+
+    await asyncio.gather(*[computer() for _ in range(jobs)])
+
+async def _writestage(results, writer, executor):
+    """Write rows from results queue with writer, and return (rows, errors)"""
+    loop = asyncio.get_running_loop()
+    numrows = numerrors = 0
+    finished = False
+    while not finished:
+        rows = [await results.get()]
+        while not results.empty():
+            rows.append(results.get_nowait())
+        if rows[-1] is _END:
+            rows.pop()
+            finished = True
+        numrows += len(rows)
+        numerrors += sum(row['status'] != 'ok' for row in rows)
+        await loop.run_in_executor(executor, lambda: [writer.write(row) for row in rows])
+    return numrows, numerrors
+
+async def _pipeline(filenames, writer, settings, jobs, readers, queuesize):
+    parsed = asyncio.Queue(queuesize)
+    results = asyncio.Queue(queuesize)
+    ioexecutor = ThreadPoolExecutor(readers + 1)
+    if jobs == 1:
+        initworker(*settings)
+        pool = ThreadPoolExecutor(1)
+    else:
+        pool = ProcessPoolExecutor(jobs, initializer=initworker, initargs=settings)
+    try:
+        async def produce():
+            await _readstage(filenames, readers, ioexecutor, parsed)
+            for _ in range(jobs):
+                await parsed.put(_END)
+
+        async def compute():
+            await _computestage(parsed, jobs, pool, results)
+            await results.put(_END)
+
+        _, _, (numrows, numerrors) = await asyncio.gather(produce(), compute(),
+                                                          _writestage(results, writer, ioexecutor))
+    finally:
+        pool.shutdown()
+        ioexecutor.shutdown()
+    return numrows, numerrors
+
+def runpipeline(filenames, outfile, fpfilename=None, k_rdel=K_RDEL, k_exp=K_EXP,
+                area=1.0, jobs=1, fmt='csv', cachedir=None, readers=4, queuesize=64):
+    """Compute energy efficiency indicators for filenames and write them to outfile
+
+    Files are read by readers concurrent readers, computed by a pool of
+    jobs processes (a thread of the current process if jobs is 1) and
+    written as they are computed. Stages are connected by queues of at
+    most queuesize items. Other arguments are those of batch.runbatch.
+
+    jobs, readers and queuesize must be at least 1.
+
+    Returns a dict with the number of 'buildings' and 'errors', the
+    elapsed time ('seconds') and the throughput ('rate', in buildings per
+    second).
+    """
+    if min(jobs, readers, queuesize) < 1:
+        raise ValueError("jobs, readers and queuesize must be at least 1")
+    writer = rowwriter(outfile, fmt)
+    settings = (fpfilename, k_rdel, k_exp, area, cachedir)
+    start = time.perf_counter()
+    numrows, numerrors = asyncio.run(_pipeline(filenames, writer, settings, jobs, readers, queuesize))
+    seconds = time.perf_counter() - start
+    return {'buildings': numrows, 'errors': numerrors, 'seconds': seconds,
+            'rate': numrows / seconds if seconds else 0.0}
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Instrumentación de las etapas de cálculo
+
+Las funciones de las etapas principales del cálculo (lectura de datos y
+factores de paso, balance energético, ponderación de los pasos A y B y
+formato de resultados) notifican, para cada llamada, un evento con su
+duración, el número de pasos de cálculo y de vectores energéticos, y la
+memoria máxima usada (si tracemalloc está activo).
+
+Los eventos se envían a las funciones registradas con addhook. Si no hay
+ninguna registrada, las funciones se llaman directamente, sin medidas.
+"""
+
+import contextlib
+import functools
+import sys
+import time
+
+# Python 2 has no perf_counter
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Registered hooks, called with each event dict
+_hooks = []
+
+def addhook(hook):
+    """Register hook to receive stage events
+
+    hook is called with a dict for each call to an instrumented stage, with
+    keys 'stage' (stage name), 'time' (wall time, in seconds), 'numsteps'
+    and 'numcarriers' (data size, or None if unknown) and 'peakmemory'
+    (peak traced memory during the stage, in bytes, or None if tracemalloc
+    is not tracing).
+    """
+    _hooks.append(hook)
+
+def removehook(hook):
+    """Unregister hook"""
+    _hooks.remove(hook)
+
+def energydatasize(energydata):
+    """Number of time steps and carriers of energy data"""
+    for carrier in energydata:
+        for ctype in energydata[carrier]:
+            for originoruse in energydata[carrier][ctype]:
+                return len(energydata[carrier][ctype][originoruse]), len(energydata)
+    return 0, len(energydata)
+
+def argsize(args, result):
+    """Data size from energy data given as first argument"""
+    return energydatasize(args[0])
+
+def resultsize(args, result):
+    """Data size from energy data returned as result"""
+    return energydatasize(result)
+
+def carriersize(args, result):
+    """Data size of single carrier stages"""
+    return None, 1
+
+def _tracingmodule():
+    """tracemalloc module if it is tracing memory, or None
+
+    tracemalloc is not imported here, since it is not available in Python 2,
+    and it can only be tracing if it has been imported.
+    """
+    tracemalloc = sys.modules.get('tracemalloc')
+    return tracemalloc if tracemalloc is not None and tracemalloc.is_tracing() else None
+
+def profiled(stage, size=None):
+    """Decorator that reports calls to the decorated function as stage events
+
+    size is a function taking the call arguments and result and returning
+    the (numsteps, numcarriers) data size of the call.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return func(*args, **kwargs)
+            tracemalloc = _tracingmodule()
+            if tracemalloc is not None and hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            start = _clock()
+            result = func(*args, **kwargs)
+            elapsed = _clock() - start
+            numsteps, numcarriers = size(args, result) if size is not None else (None, None)
+            event = {'stage': stage, 'time': elapsed,
+                     'numsteps': numsteps, 'numcarriers': numcarriers,
+                     'peakmemory': tracemalloc.get_traced_memory()[1] if tracemalloc is not None else None}
+            for hook in list(_hooks):
+                hook(event)
+            return result
+        return wrapper
+    return decorator
+
+class ProfileReport(object):
+    """Hook that accumulates stage events and summarizes them by stage"""
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def summary(self):
+        """Per stage aggregates, in order of first appearance
+
+        Returns a list of dicts with keys 'stage', 'calls', 'time' (total),
+        'numsteps' and 'numcarriers' (maximum and total) and 'peakmemory'
+        (maximum).
+        """
+        stages = []
+        bystage = {}
+        for event in self.events:
+            name = event['stage']
+            if name not in bystage:
+                bystage[name] = {'stage': name, 'calls': 0, 'time': 0.0,
+                                 'numsteps': None, 'numcarriers': None, 'peakmemory': None}
+                stages.append(bystage[name])
+            stage = bystage[name]
+            stage['calls'] += 1
+            stage['time'] += event['time']
+            if event['numsteps'] is not None:
+                stage['numsteps'] = max(stage['numsteps'] or 0, event['numsteps'])
+            if event['numcarriers'] is not None:
+                stage['numcarriers'] = (stage['numcarriers'] or 0) + event['numcarriers']
+            if event['peakmemory'] is not None:
+                stage['peakmemory'] = max(stage['peakmemory'] or 0, event['peakmemory'])
+        return stages
+
+    def report(self):
+        """Stage summary as text table"""
+        def fmt(value, spec):
+            return u'-' if value is None else spec % value
+
+        lines = [u'%-32s %6s %10s %8s %9s %12s' % (u'Etapa', u'Llam.', u'Tiempo(s)', u'Pasos', u'Vectores', u'Memoria(kB)')]
+        for stage in self.summary():
+            peakmemory = None if stage['peakmemory'] is None else stage['peakmemory'] / 1024.0
+            lines.append(u'%-32s %6i %10.4f %8s %9s %12s' % (
+                stage['stage'], stage['calls'], stage['time'],
+                fmt(stage['numsteps'], u'%i'), fmt(stage['numcarriers'], u'%i'), fmt(peakmemory, u'%.1f')))
+        return u'\n'.join(lines) + u'\n'
+
+@contextlib.contextmanager
+def profile(tracememory=False):
+    """Context manager that records stage events in a ProfileReport
+
+    If tracememory is True, memory use is traced with tracemalloc while
+    active, which slows down the calculation. Memory is not traced in
+    Python 2, where tracemalloc is not available.
+
+        with profile() as report:
+            ...
+        print(report.report())
+    """
+    report = ProfileReport()
+    tracemalloc = None
+    if tracememory:
+        try:
+            import tracemalloc
+        except ImportError: # Python 2
+            pass
+    starttracing = tracemalloc is not None and not tracemalloc.is_tracing()
+    if starttracing:
+        tracemalloc.start()
+    addhook(report)
+    try:
+        yield report
+    finally:
+        removehook(report)
+        if starttracing:
+            tracemalloc.stop()
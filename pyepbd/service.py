@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# 
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Servicio HTTP local de cálculo de la eficiencia energética
+
+Mantiene cargados los factores de paso y atiende peticiones de cálculo
+concurrentes en formato JSON, usando solamente la biblioteca estándar:
+
+    $ python -m pyepbd serve --port 8000 -f cte=factores_paso_20140203.csv
+
+Peticiones:
+
+- GET /factors: nombres de los conjuntos de factores de paso disponibles
+- POST /calculate: cálculo de los indicadores de eficiencia energética.
+  El cuerpo de la petición es un objeto JSON con las claves:
+  - data: datos energéticos como lista de objetos con las claves carrier,
+    ctype, originoruse y values (ver readenergydata)
+  - factors (opcional): nombre del conjunto de factores de paso o lista de
+    factores [vector, fuente, uso, paso, ren, nren] (ver readfactorsdata)
+  - krdel, kexp, area (opcionales): parámetros del cálculo
+  La petición debe indicar su tamaño (Content-Length), hasta un máximo de
+  MAXREQUESTSIZE bytes.
+  La respuesta es un objeto JSON con los indicadores (ver ep2dict).
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+except ImportError: # Python < 3.7
+    ThreadingHTTPServer = None
+
+from .settings import K_EXP, K_RDEL, FACTORESDEPASOOFICIALES
+from .energycalculations import weighted_energy
+from .factors import FactorTable
+from .inputoutput import readenergydata, readfactors, readfactorsdata, ep2dict
+
+# Name of the official weighting factors set
+OFFICIALFACTORS = 'oficiales'
+
+# Maximum request body size, in bytes
+MAXREQUESTSIZE = 64 * 1024 * 1024
+
+class Calculator(object):
+    """Energy efficiency calculator with preloaded weighting factor sets
+
+    Weighting factor sets are FactorTables indexed by name, and include the
+    official factors (FACTORESDEPASOOFICIALES) as OFFICIALFACTORS.
+    Calculations can be run concurrently from several threads.
+
+    If allowfiles is True, factor set references that are not loaded sets
+    are read as weighting factors files, and kept for later requests.
+    """
+
+    def __init__(self, factorsets=None, k_rdel=K_RDEL, k_exp=K_EXP, allowfiles=False):
+        self.k_rdel = k_rdel
+        self.k_exp = k_exp
+        self.allowfiles = allowfiles
+        self._lock = threading.Lock()
+        self.factorsets = {OFFICIALFACTORS: FACTORESDEPASOOFICIALES}
+        for name, fp in (factorsets or {}).items():
+            self.addfactorset(name, fp)
+
+    def addfactorset(self, name, fp):
+        """Add weighting factors fp (list or FactorTable) as set name"""
+        table = fp if isinstance(fp, FactorTable) else FactorTable(fp)
+        with self._lock:
+            # replace the dict so that concurrent readers see a consistent state
+            factorsets = dict(self.factorsets)
+            factorsets[name] = table
+            self.factorsets = factorsets
+
+    def loadfactorset(self, name, filename):
+        """Read weighting factors file filename as set name"""
+        self.addfactorset(name, readfactors(filename))
+
+    def factorset(self, ref=None):
+        """Weighting factors for ref
+
+        ref is either None (official factors), the name of a factor set or a
+        list of factors as [vector, fuente, uso, step, ren, nren] lists.
+        With allowfiles, it can also be the name of a weighting factors file.
+        """
+        if ref is None:
+            ref = OFFICIALFACTORS
+        if isinstance(ref, list):
+            return readfactorsdata(ref)
+        if self.allowfiles and ref not in self.factorsets and os.path.isfile(ref):
+            self.loadfactorset(ref, ref)
+        try:
+            return self.factorsets[ref]
+        except (KeyError, TypeError):
+            raise ValueError("Unknown weighting factors set '%s'. Available sets: %s"
+                             % (ref, ', '.join(sorted(self.factorsets))))
+
+    def calculate(self, request):
+        """Energy efficiency indicators (see ep2dict) for request
+
+        request is a dict with keys 'data' (list of energy data, see
+        readenergydata) and, optionally, 'factors' (see factorset), 'krdel',
+        'kexp' and 'area'.
+
+        Raises ValueError for invalid requests.
+        """
+        if not isinstance(request, dict) or 'data' not in request:
+            raise ValueError("Request must be an object with a 'data' key")
+        try:
+            data = readenergydata(request['data'])
+        except (KeyError, TypeError) as e:
+            raise ValueError("Invalid energy data: %s" % e)
+        fp = self.factorset(request.get('factors'))
+        k_rdel = _requestnumber(request, 'krdel', self.k_rdel)
+        k_exp = _requestnumber(request, 'kexp', self.k_exp)
+        area = _requestnumber(request, 'area', 1.0)
+        if area <= 0:
+            raise ValueError("Invalid value for 'area': %s. It must be greater than 0" % area)
+        try:
+            return ep2dict(weighted_energy(data, k_rdel, fp, k_exp, check=True), area)
+        except (TypeError, ZeroDivisionError) as e:
+            raise ValueError("Invalid request: %s" % e)
+
+def _requestnumber(request, key, default):
+    """Value of key in request as float, or default if missing"""
+    value = request.get(key, default)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid value for '%s': %s. It must be a number" % (key, json.dumps(value)))
+
+if ThreadingHTTPServer is not None:
+    class CalculationRequestHandler(BaseHTTPRequestHandler):
+        """HTTP request handler for calculation requests (see module doc)"""
+
+        server_version = 'pyepbd'
+
+        def _respond(self, status, content):
+            body = json.dumps(content).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/factors':
+                self._respond(200, sorted(self.server.calculator.factorsets))
+            else:
+                self._respond(404, {'error': 'Not found: %s' % self.path})
+
+        def do_POST(self):
+            if self.path != '/calculate':
+                self._respond(404, {'error': 'Not found: %s' % self.path})
+                return
+            header = self.headers.get('Content-Length')
+            if header is None:
+                self._respond(411, {'error': 'Content-Length required'})
+                return
+            try:
+                length = int(header)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._respond(400, {'error': 'Invalid Content-Length: %s' % header})
+                return
+            if length > MAXREQUESTSIZE:
+                self._respond(413, {'error': 'Request too large'})
+                return
+            try:
+                request = json.loads(self.rfile.read(length).decode('utf-8'))
+                result = self.server.calculator.calculate(request)
+            except ValueError as e:
+                self._respond(400, {'error': u'%s' % e})
+            except Exception as e:
+                self._respond(500, {'error': u'%s' % e})
+            else:
+                self._respond(200, result)
+
+        def log_message(self, format, *args):
+            if not self.server.quiet:
+                BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def makeserver(calculator, host='127.0.0.1', port=8000, quiet=False):
+    """HTTP server for calculation requests using calculator
+
+    Requests are handled concurrently, each in its own thread.
+    """
+    if ThreadingHTTPServer is None:
+        raise RuntimeError("The calculation service requires Python 3.7 or later")
+    server = ThreadingHTTPServer((host, port), CalculationRequestHandler)
+    server.daemon_threads = True
+    server.calculator = calculator
+    server.quiet = quiet
+    return server
+
+def loadfactorsets(calculator, fpfiles, parser):
+    """Load NAME=FPFILE weighting factor sets of fpfiles in calculator
+
+    Badly formatted sets are reported as parser errors.
+    """
+    for fpfile in fpfiles:
+        name, sep, filename = fpfile.partition('=')
+        if not sep:
+            parser.error(u'formato incorrecto de conjunto de factores de paso: %s' % fpfile)
+        calculator.loadfactorset(name, filename)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pyepbd serve',
+                                     description=u'Servicio HTTP local de cálculo de la eficiencia energética')
+    parser.add_argument('--host', dest='host', default='127.0.0.1',
+                        help=u'dirección de escucha (127.0.0.1 por defecto)')
+    parser.add_argument('--port', dest='port', type=int, default=8000,
+                        help=u'puerto de escucha (8000 por defecto)')
+    parser.add_argument('-f', '--factores', dest='fpfiles', action='append', default=[], metavar='NOMBRE=FPFILE',
+                        help=u'conjunto de factores de paso a cargar, con su nombre (se puede repetir)')
+    parser.add_argument('--krdel', type=float, default=K_RDEL,
+                        help=u'factor de resuministro (k_rdel) predeterminado')
+    parser.add_argument('--kexp', type=float, default=K_EXP,
+                        help=u'factor de exportacion (k_exp) predeterminado')
+    parser.add_argument('-q', '--quiet', dest='quiet', action='store_true', default=False,
+                        help=u'no muestra el registro de peticiones')
+    args = parser.parse_args(argv)
+
+    calculator = Calculator(k_rdel=args.krdel, k_exp=args.kexp)
+    loadfactorsets(calculator, args.fpfiles, parser)
+
+    server = makeserver(calculator, args.host, args.port, args.quiet)
+    sys.stderr.write(u'Servicio de cálculo en http://%s:%i/ (factores de paso: %s)\n'
+                     % (args.host, server.server_address[1], ', '.join(sorted(calculator.factorsets))))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -30,6 +30,8 @@ building code regulations (Código Técnico de la Edificación CTE).
 Weighting factors are based on primary energy use.
 """
 
+from .factors import FactorTable
+
 # These are all provisional values subject to change
 K_EXP = 0.0
 
@@ -108,5 +110,5 @@ FACTORESDEPASO = [
     ['RED2',                'grid',         'input',    'A', 0.000, 1.300], # User defined!, district heating/cooling carrier
 ]
 
-FACTORESDEPASOOFICIALES = [{'vector': vector, 'fuente': fuente, 'uso': uso, 'step': step, 'ren': fren, 'nren': fnren}
-                           for (vector, fuente, uso, step, fren, fnren) in FACTORESDEPASO]
+FACTORESDEPASOOFICIALES = FactorTable({'vector': vector, 'fuente': fuente, 'uso': uso, 'step': step, 'ren': fren, 'nren': fnren}
+                                      for (vector, fuente, uso, step, fren, fnren) in FACTORESDEPASO)
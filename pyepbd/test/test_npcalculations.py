@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os, sys
+import pytest
+
+np = pytest.importorskip('numpy')
+
+currpath = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.join(currpath, '..'))
+
+from pyepbd import weighted_energy, readenergyfile, readfactors
+from pyepbd.energycalculations import energycomponents
+
+TESTFP = readfactors(os.path.join(currpath, '../examples/factores_paso_test.csv'))
+CTEFP = readfactors(os.path.join(currpath, '../examples/factores_paso_20140203.csv'))
+EXAMPLES = ['ejemplo1base.csv', 'ejemplo1PV.csv', 'ejemplo1xPV.csv', 'ejemplo2xPVgas.csv',
+            'ejemplo3PVBdC.csv', 'ejemplo4cgnfosil.csv', 'ejemplo5cgnbiogas.csv', 'ejemplo6K3.csv']
+
+def exampledata(filename):
+    return readenergyfile(os.path.join(currpath, '../examples', filename))
+
+def assert_close_ep(EP1, EP2):
+    for key in ('EP', 'EPpasoA'):
+        for part in ('ren', 'nren'):
+            assert EP1[key][part] == pytest.approx(EP2[key][part], rel=1e-9, abs=1e-9)
+
+@pytest.mark.parametrize('filename', EXAMPLES)
+@pytest.mark.parametrize('fp', [TESTFP, CTEFP])
+def test_numpy_backend_matches_python(filename, fp):
+    data = exampledata(filename)
+    EPpy = weighted_energy(data, 1.0, fp, 1.0)
+    EPnp = weighted_energy(data, 1.0, fp, 1.0, backend='numpy')
+    assert_close_ep(EPpy, EPnp)
+
+def test_numpy_backend_components_are_arrays():
+    components = energycomponents(exampledata('ejemplo6K3.csv'), 1.0, backend='numpy', temporal=True)
+    temporal = components['ELECTRICIDAD']['temporal']
+    assert isinstance(temporal['INSITU']['to_grid'], np.ndarray)
+    assert len(temporal['INSITU']['to_grid']) == 12
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        weighted_energy(exampledata('ejemplo1base.csv'), 1.0, TESTFP, 1.0, backend='fortran')
+
+def test_weighted_energy_batch():
+    from pyepbd.npcalculations import energydata2array, weighted_energy_batch
+    datalist = [exampledata(filename) for filename in EXAMPLES]
+    carriers, values = energydata2array(datalist)
+    assert values.shape == (len(EXAMPLES), len(carriers), 4, 12)
+    EPbatch = weighted_energy_batch(values, carriers, CTEFP, 1.0, 1.0, chunksize=3)
+    for ii, data in enumerate(datalist):
+        EP = weighted_energy(data, 1.0, CTEFP, 1.0)
+        EPii = {key: {part: EPbatch[key][part][ii] for part in ('ren', 'nren')} for key in EPbatch}
+        assert_close_ep(EP, EPii)
+
+def test_weighted_energy_batch_missingfactors():
+    from pyepbd.npcalculations import energydata2array, weighted_energy_batch
+    carriers, values = energydata2array([exampledata('ejemplo2xPVgas.csv')])
+    fp = [fpi for fpi in CTEFP if fpi['vector'] != 'GASNATURAL']
+    with pytest.raises(ValueError):
+        weighted_energy_batch(values, carriers, fp, 1.0, 1.0)
+
+@pytest.mark.parametrize('filename', ['ejemplo1xPV.csv', 'ejemplo4cgnfosil.csv', 'ejemplo6K3.csv'])
+def test_weighted_energy_sweep(filename):
+    from pyepbd.analysis import weighted_energy_sweep
+    data = exampledata(filename)
+    k_rdels = [0.0, 0.5, 1.0]
+    k_exps = [0.0, 0.3, 1.0]
+    EPsweep = weighted_energy_sweep(data, CTEFP, k_rdels, k_exps)
+    assert EPsweep['EP']['ren'].shape == (3, 3)
+    for ii, k_rdel in enumerate(k_rdels):
+        for jj, k_exp in enumerate(k_exps):
+            EP = weighted_energy(data, k_rdel, CTEFP, k_exp)
+            EPij = {key: {part: EPsweep[key][part][ii, jj] for part in ('ren', 'nren')} for key in EPsweep}
+            assert_close_ep(EP, EPij)
+
+def test_weighted_energy_factorsets():
+    from pyepbd import FACTORESDEPASOOFICIALES
+    from pyepbd.analysis import weighted_energy_factorsets
+    fpsets = {'test': TESTFP, 'cte': CTEFP, 'oficiales': FACTORESDEPASOOFICIALES}
+    for filename in EXAMPLES:
+        data = exampledata(filename)
+        results = weighted_energy_factorsets(data, fpsets, 1.0, 1.0)
+        assert list(results.keys()) == list(fpsets.keys())
+        for name in fpsets:
+            assert_close_ep(weighted_energy(data, 1.0, fpsets[name], 1.0), results[name])
+
+def test_weighted_energy_factorsets_missing():
+    from pyepbd.analysis import weighted_energy_factorsets
+    fp = [fpi for fpi in CTEFP if fpi['vector'] != 'GASNATURAL']
+    with pytest.raises(ValueError) as excinfo:
+        weighted_energy_factorsets(exampledata('ejemplo2xPVgas.csv'), [CTEFP, fp], 1.0, 1.0)
+    assert 'GASNATURAL' in str(excinfo.value)
+
+def test_compactenergydata_backends():
+    data = exampledata('ejemplo3PVBdC.csv')
+    compact = readenergyfile(os.path.join(currpath, '../examples/ejemplo3PVBdC.csv'), compact=True)
+    assert_close_ep(weighted_energy(compact, 1.0, TESTFP, 1.0, backend='numpy'),
+                    weighted_energy(data, 1.0, TESTFP, 1.0))
+    from pyepbd.npcalculations import energydata2array
+    carriers, values = energydata2array([compact])
+    assert np.array_equal(values, energydata2array([data])[1])
+
+def test_weighted_energy_montecarlo():
+    from pyepbd.analysis import weighted_energy_montecarlo
+    data = exampledata('ejemplo3PVBdC.csv')
+    EP = weighted_energy(data, 1.0, TESTFP, 1.0)
+    # no uncertainty gives the deterministic result for all percentiles
+    results = weighted_energy_montecarlo(data, TESTFP, 1.0, 1.0, [], numsamples=10)
+    assert_close_ep({key: {part: results[key][part][1] for part in ('ren', 'nren')} for key in ('EP', 'EPpasoA')}, EP)
+    perturbations = [('ELECTRICIDAD', 'CONSUMO', 'EPB', 'noise', 0.1),
+                     ('ELECTRICIDAD', 'PRODUCCION', 'INSITU', 'scale', 0.2)]
+    results = weighted_energy_montecarlo(data, TESTFP, 1.0, 1.0, perturbations, numsamples=500, seed=1, chunksize=64)
+    again = weighted_energy_montecarlo(data, TESTFP, 1.0, 1.0, perturbations, numsamples=500, seed=1, chunksize=64)
+    assert np.array_equal(results['EP']['nren'], again['EP']['nren'])
+    for key in ('EP', 'EPpasoA'):
+        for part in ('ren', 'nren', 'rer'):
+            assert results[key][part][0] <= results[key][part][1] <= results[key][part][2]
+    assert results['EP']['nren'][0] < EP['EP']['nren'] < results['EP']['nren'][2]
+    with pytest.raises(ValueError):
+        weighted_energy_montecarlo(data, TESTFP, 1.0, 1.0, [('GASOLEO', 'CONSUMO', 'EPB', 'noise', 0.1)])
+
+def test_sizeproduction():
+    from pyepbd.analysis import weighted_energy_sizing, sizeproduction
+    data = exampledata('ejemplo1base.csv')
+    unit = np.array(exampledata('ejemplo1PV.csv')['ELECTRICIDAD']['PRODUCCION']['INSITU'])
+    unit = unit / unit.sum()
+    profiles = {'pv': unit, 'flat': np.ones(12) / 12.0}
+    capacities = [0.0, 50.0, 100.0, 200.0]
+    names, EP = weighted_energy_sizing(data, CTEFP, 1.0, 1.0, 'ELECTRICIDAD', 'INSITU', profiles, capacities)
+    # matches adding the production series to data
+    ii = names.index('pv')
+    for jj, capacity in enumerate(capacities):
+        sized = {carrier: {ctype: dict(series) for (ctype, series) in data[carrier].items()} for carrier in data}
+        sized['ELECTRICIDAD']['PRODUCCION']['INSITU'] = list(capacity * unit)
+        assert_close_ep({key: {part: EP[key][part][ii, jj] for part in ('ren', 'nren')} for key in ('EP', 'EPpasoA')},
+                        weighted_energy(sized, 1.0, CTEFP, 1.0))
+    assert EP['EP']['nren'][ii, 1] > EP['EP']['nren'][ii, 2]
+    target = EP['EP']['nren'][ii, 2]
+    sizes = sizeproduction(data, CTEFP, 1.0, 1.0, 'ELECTRICIDAD', 'INSITU', profiles, capacities, target)
+    assert sizes['pv'] == 100.0
+    assert sizeproduction(data, CTEFP, 1.0, 1.0, 'ELECTRICIDAD', 'INSITU', profiles, capacities, -1e6, 'nren')['pv'] is None
+    assert sizeproduction(data, CTEFP, 1.0, 1.0, 'ELECTRICIDAD', 'INSITU', profiles, capacities, 0.0, 'rer')['flat'] == 0.0
+
+def test_weighted_energy_stream(buildingsfile):
+    from pyepbd import readbuildingsfile
+    from pyepbd.npcalculations import weighted_energy_stream
+    names = [filename[:-4] for filename in EXAMPLES]
+    datafile = buildingsfile(names)
+    # buildings with different numbers of timesteps in the same chunk
+    hourly = {'ELECTRICIDAD': {'CONSUMO': {'EPB': [1.0] * 24, 'NEPB': [0.0] * 24},
+                               'PRODUCCION': {'INSITU': [0.5] * 24, 'COGENERACION': [0.0] * 24}}}
+    with open(datafile, 'a') as ff:
+        ff.write(u'horario,ELECTRICIDAD,CONSUMO,EPB,' + u','.join([u'1.0'] * 24) + u'\n')
+        ff.write(u'horario,ELECTRICIDAD,PRODUCCION,INSITU,' + u','.join([u'0.5'] * 24) + u'\n')
+    results = list(weighted_energy_stream(readbuildingsfile(datafile), TESTFP, 1.0, 1.0, chunksize=3))
+    assert [buildingid for (buildingid, EP) in results] == names + ['horario']
+    for buildingid, EP in results[:-1]:
+        assert_close_ep(EP, weighted_energy(exampledata(buildingid + '.csv'), 1.0, TESTFP, 1.0))
+    assert_close_ep(results[-1][1], weighted_energy(hourly, 1.0, TESTFP, 1.0))
+
+def test_createfiles(tmp_path):
+    from pyepbd.examples.createfiles import (DIASMES, NUMPASOS, expandeperfil, perfilP1,
+                                             edificiosintetico, createfile)
+    monthly = perfilP1(100.0)
+    assert len(monthly) == 12
+    for numsteps in NUMPASOS[1:]:
+        hourly = perfilP1(100.0, numsteps)
+        assert len(hourly) == numsteps
+        # monthly totals are kept
+        bounds = np.cumsum([0] + DIASMES) * (numsteps // 365)
+        totals = [hourly[start:end].sum() for (start, end) in zip(bounds[:-1], bounds[1:])]
+        assert np.allclose(totals, monthly)
+    try:
+        expandeperfil(monthly, 24, [1.0] * 24)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+    building = edificiosintetico(8760, 3, seed=1)
+    assert [(carrier, ctype, originoruse) for (carrier, ctype, originoruse, values) in building] == [
+        ('ELECTRICIDAD', 'CONSUMO', 'EPB'), ('ELECTRICIDAD', 'CONSUMO', 'NEPB'),
+        ('ELECTRICIDAD', 'PRODUCCION', 'INSITU'), ('ELECTRICIDAD', 'PRODUCCION', 'COGENERACION'),
+        ('GASNATURAL', 'CONSUMO', 'EPB'), ('GASOLEO', 'CONSUMO', 'EPB')]
+    monthlybuilding = edificiosintetico(12, 3, seed=1)
+    for (_, _, _, values), (_, _, _, monthlyvalues) in zip(building, monthlybuilding):
+        assert len(values) == 8760
+        assert np.isclose(values.sum(), monthlyvalues.sum())
+
+    filename = str(tmp_path / 'sintetico.csv')
+    createfile(filename, building, decimales=6)
+    data = readenergyfile(filename)
+    assert len(data['ELECTRICIDAD']['CONSUMO']['EPB']) == 8760
+    assert abs(sum(data['GASOLEO']['CONSUMO']['EPB']) - building[-1][3].sum()) < 1e-3
@@ -31,7 +31,8 @@ from pyepbd import (FACTORESDEPASOOFICIALES,
                     weighted_energy,
                     readenergyfile,
                     readenergydata,
-                    ep2string, readfactors)
+                    ep2string, readfactors,
+                    FactorTable)
 
 def check(EPB, res):
     """Check that result is within valid range"""
@@ -152,3 +153,515 @@ def test_fromdata():
             ]
     EP = epfromdata(datalist, TESTKRDEL, TESTKEXP, CTEFP)
     assert check(EP, [177.5, 39.6])
+
+def test_factortable():
+    assert isinstance(CTEFP, FactorTable)
+    fp = FactorTable(FACTORESDEPASOOFICIALES)
+    assert fp.factor('ELECTRICIDAD', 'INSITU', 'to_grid', 'B')['nren'] == 1.954
+    assert fp.factor('ELECTRICIDAD', 'INSITU', 'to_grid', 'C') is None
+    assert fp.forcarrier('GLP') is fp.forcarrier('GLP')
+    assert len(fp.forcarrier('GLP')) == 1
+
+def test_factortable_plainlist():
+    # plain lists of factors are still accepted
+    EP = epfromfile('../examples/ejemplo6K3.csv', TESTKRDEL, TESTKEXP, list(TESTFP))
+    assert check(EP, [1385.5, -662])
+
+def test_runbatch():
+    import io, json
+    from pyepbd.batch import runbatch
+    filenames = [os.path.join(currpath, '../examples/ejemplo6K3.csv'),
+                 os.path.join(currpath, '../examples/ejemplo3PVBdC.csv'),
+                 os.path.join(currpath, 'noexiste.csv')]
+    fpfilename = os.path.join(currpath, '../examples/factores_paso_test.csv')
+    for jobs in (1, 2):
+        outfile = io.StringIO()
+        numerrors = runbatch(filenames, outfile, fpfilename, TESTKRDEL, TESTKEXP, jobs=jobs, fmt='jsonl')
+        rows = [json.loads(line) for line in outfile.getvalue().splitlines()]
+        assert numerrors == 1
+        assert [row['file'] for row in rows] == filenames
+        assert [row['status'] for row in rows] == ['ok', 'ok', 'error']
+        assert abs(rows[0]['EPren'] - 1385.5) < 0.1 and abs(rows[0]['EPnren'] + 662) < 0.1
+
+def test_readenergyfile_accumulates():
+    # ejemplo4cgnfosil has two GASNATURAL, CONSUMO, EPB lines
+    data = readenergyfile(os.path.join(currpath, '../examples/ejemplo4cgnfosil.csv'))
+    assert abs(data['GASNATURAL']['CONSUMO']['EPB'][0] - (16.39 + 25.90)) < 1e-9
+    assert data['GASNATURAL']['CONSUMO']['NEPB'] == [0.0] * 12
+    assert isinstance(data['GASNATURAL']['CONSUMO']['EPB'], list)
+
+def test_readenergyfile_numsteps(tmp_path):
+    datafile = tmp_path / 'pasos.csv'
+    datafile.write_text(u'vector,tipo,src_dst\n'
+                        u'ELECTRICIDAD,CONSUMO,EPB,1.0,2.0,3.0\n'
+                        u'ELECTRICIDAD,PRODUCCION,INSITU,1.0,2.0\n')
+    try:
+        readenergyfile(str(datafile))
+    except ValueError as e:
+        assert 'same number of timesteps' in str(e)
+        assert 'line 3:' in str(e)
+    else:
+        assert False
+    # parse errors report the same (1-based) file line numbers
+    datafile.write_text(u'vector,tipo,src_dst\n'
+                        u'ELECTRICIDAD,CONSUMO,EPB,1.0,2.0\n'
+                        u'ELECTRICIDAD,PRODUCTO,INSITU,1.0,2.0\n')
+    try:
+        readenergyfile(str(datafile))
+    except ValueError as e:
+        assert 'line 3\n' in str(e)
+    else:
+        assert False
+
+def test_energybinary(tmp_path):
+    from pyepbd.binaryio import csv2binary, readenergybinary
+    filenames = [os.path.join(currpath, '../examples/%s.csv' % name)
+                 for name in ('ejemplo3PVBdC', 'ejemplo6K3')]
+    binfilename = str(tmp_path / 'ejemplos.epbdbin')
+    csv2binary(filenames, binfilename)
+    binfile = readenergybinary(binfilename)
+    assert binfile.ids == ['ejemplo3PVBdC', 'ejemplo6K3']
+    EP = weighted_energy(binfile['ejemplo6K3'], TESTKRDEL, TESTFP, TESTKEXP)
+    assert check(EP, [1385.5, -662])
+    for (buildingid, data), filename in zip(binfile, filenames):
+        assert list(data['ELECTRICIDAD']['CONSUMO']['EPB']) == list(readenergyfile(filename)['ELECTRICIDAD']['CONSUMO']['EPB'])
+    # series still in use are released on close
+    series = data['ELECTRICIDAD']['CONSUMO']['EPB']
+    binfile.close()
+    try:
+        series[0]
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_resultcache(tmp_path):
+    from pyepbd.cache import ResultCache, cachekey, cached_weighted_energy
+    cachedir = str(tmp_path)
+    data = readenergyfile(os.path.join(currpath, '../examples/ejemplo6K3.csv'))
+    cache = ResultCache(cachedir, maxsize=400)
+    key = cachekey(data, TESTFP, TESTKRDEL, TESTKEXP)
+    assert key == cachekey(data, list(reversed(TESTFP)), TESTKRDEL, TESTKEXP)
+    assert key != cachekey(data, TESTFP, TESTKRDEL, 0.0)
+    assert cache.get(key) is None
+    EP = cached_weighted_energy(data, TESTKRDEL, TESTFP, TESTKEXP, cache)
+    assert cache.get(key) == EP
+    # size limit evicts least recently used results
+    for k_exp in (0.1, 0.2, 0.3, 0.4):
+        cached_weighted_energy(data, TESTKRDEL, TESTFP, k_exp, cache)
+    assert cache.size <= 400
+    assert cache.get(key) is None
+    # results of other versions are removed
+    os.rename(cache.directory, os.path.join(cachedir, 'pyepbd-0.0'))
+    cache = ResultCache(cachedir)
+    assert os.listdir(cachedir) == [os.path.basename(cache.directory)]
+
+def test_profiling_hooks():
+    from pyepbd.profiling import addhook, removehook, profile
+    events = []
+    addhook(events.append)
+    try:
+        EP = epfromfile('../examples/ejemplo6K3.csv', TESTKRDEL, TESTKEXP, TESTFP)
+    finally:
+        removehook(events.append)
+    stages = [event['stage'] for event in events]
+    assert stages[:2] == ['readenergyfile', 'energycomponents']
+    assert 'gridsavings_stepB' in stages
+    assert events[0]['numsteps'] == 12 and events[0]['numcarriers'] == 1
+    # no events without hooks
+    epfromfile('../examples/ejemplo6K3.csv', TESTKRDEL, TESTKEXP, TESTFP)
+    assert len(events) == len(stages)
+    with profile(tracememory=True) as report:
+        ep2string(epfromfile('../examples/ejemplo3PVBdC.csv', TESTKRDEL, TESTKEXP, TESTFP))
+    summary = dict((stage['stage'], stage) for stage in report.summary())
+    assert summary['energycomponents']['numcarriers'] == 2
+    assert summary['ep2string']['calls'] == 1
+    assert summary['readenergyfile']['peakmemory'] > 0
+
+# data from ejemplo3PVBdC_normativo
+FROMDATA = [
+    {'values': [9.67, 7.74, 4.84, 4.35, 2.42, 2.9, 3.87, 3.39, 2.42, 3.87, 5.8, 7.74],
+     'carrier': 'ELECTRICIDAD', 'ctype': 'CONSUMO', 'originoruse': 'EPB'},
+    {'values': [1.13, 1.42, 1.99, 2.84, 4.82, 5.39, 5.67, 5.11, 4.54, 3.40, 2.27, 1.42],
+     'carrier': 'ELECTRICIDAD', 'ctype': 'PRODUCCION', 'originoruse': 'INSITU'},
+    {'values': [21.48, 17.18, 10.74, 9.66, 5.37, 6.44, 8.59, 7.52, 5.37, 8.59, 12.89, 17.18],
+     'carrier': 'MEDIOAMBIENTE', 'ctype': 'CONSUMO', 'originoruse': 'EPB'},
+    {'values': [21.48, 17.18, 10.74, 9.66, 5.37, 6.44, 8.59, 7.52, 5.37, 8.59, 12.89, 17.18],
+     'carrier': 'MEDIOAMBIENTE', 'ctype': 'PRODUCCION', 'originoruse': 'INSITU'}
+    ]
+
+def test_service():
+    import json, threading
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError
+    from pyepbd.service import Calculator, makeserver
+    calculator = Calculator({'cte': CTEFP})
+    server = makeserver(calculator, port=0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:%i' % server.server_address[1]
+    def post(request):
+        return json.loads(urlopen(Request(url + '/calculate', json.dumps(request).encode('utf-8'))).read().decode('utf-8'))
+    try:
+        assert json.loads(urlopen(url + '/factors').read().decode('utf-8')) == ['cte', 'oficiales']
+        request = {'data': FROMDATA, 'factors': 'cte', 'krdel': TESTKRDEL, 'kexp': TESTKEXP}
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(post, [request] * 8))
+        for result in results:
+            assert abs(result['EPren'] - 177.5) + abs(result['EPnren'] - 39.6) < 2.0
+        for badrequest in [{'data': FROMDATA, 'factors': 'noexiste'},
+                           {'data': FROMDATA, 'factors': 'cte', 'krdel': None},
+                           {'data': FROMDATA, 'factors': 'cte', 'kexp': None},
+                           {'data': FROMDATA, 'factors': 'cte', 'area': 0}]:
+            try:
+                post(badrequest)
+            except HTTPError as e:
+                assert e.code == 400
+            else:
+                assert False
+        # missing, invalid and too large request sizes
+        from http.client import HTTPConnection
+        from pyepbd.service import MAXREQUESTSIZE
+        for length, status in [(None, 411), ('abc', 400), ('-1', 400), (str(MAXREQUESTSIZE + 1), 413)]:
+            connection = HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+            connection.putrequest('POST', '/calculate')
+            if length is not None:
+                connection.putheader('Content-Length', length)
+            connection.endheaders()
+            assert connection.getresponse().status == status
+            connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def test_worker():
+    import io, json
+    from pyepbd.service import Calculator
+    from pyepbd.worker import runworker
+    fpfile = os.path.join(currpath, '../examples/factores_paso_20140203.csv')
+    lines = [json.dumps({'id': 'a', 'data': FROMDATA, 'factors': fpfile, 'krdel': TESTKRDEL, 'kexp': TESTKEXP}),
+             '{not json',
+             json.dumps({'id': 'c', 'data': FROMDATA, 'factors': 'noexiste'}),
+             json.dumps({'id': 'd', 'data': FROMDATA, 'factors': fpfile, 'krdel': TESTKRDEL, 'kexp': TESTKEXP})]
+    infile = io.StringIO(u'\n'.join(lines) + u'\n')
+    outfile = io.StringIO()
+    calculator = Calculator(allowfiles=True)
+    numrequests, numerrors = runworker(calculator, infile, outfile, queuesize=2)
+    responses = [json.loads(line) for line in outfile.getvalue().splitlines()]
+    assert (numrequests, numerrors) == (4, 2)
+    assert [response['status'] for response in responses] == ['ok', 'error', 'error', 'ok']
+    assert [response['line'] for response in responses] == [1, 2, 3, 4]
+    assert responses[3]['id'] == 'd'
+    assert abs(responses[3]['result']['EPren'] - 177.5) + abs(responses[3]['result']['EPnren'] - 39.6) < 2.0
+    assert fpfile in calculator.factorsets
+    # queues must be bounded
+    try:
+        runworker(calculator, io.StringIO(), io.StringIO(), queuesize=0)
+    except ValueError:
+        pass
+    else:
+        assert False
+    from pyepbd.worker import main
+    for queuesize in ('0', '-1'):
+        try:
+            main(['--queue', queuesize], io.StringIO(), io.StringIO())
+        except SystemExit as e:
+            assert e.code == 2
+        else:
+            assert False
+
+def test_energymodel():
+    from array import array
+    from pyepbd.model import EnergyModel
+    data = readenergyfile(os.path.join(currpath, '../examples/ejemplo3PVBdC.csv'))
+    model = EnergyModel(data, TESTFP, TESTKRDEL, TESTKEXP)
+    assert model.weighted_energy() == weighted_energy(data, TESTKRDEL, TESTFP, TESTKEXP)
+    # only the changed carrier is recomputed
+    otherweighted = model.carrierweighted_energy('MEDIOAMBIENTE')
+    production = array('d', [2.0 * value for value in data['ELECTRICIDAD']['PRODUCCION']['INSITU']])
+    model.setseries('ELECTRICIDAD', 'PRODUCCION', 'INSITU', production)
+    EP = model.weighted_energy()
+    assert model.carrierweighted_energy('MEDIOAMBIENTE') is otherweighted
+    data['ELECTRICIDAD']['PRODUCCION']['INSITU'] = production
+    assert EP == weighted_energy(data, TESTKRDEL, TESTFP, TESTKEXP)
+    # k_rdel changes recompute all carriers
+    model.k_rdel = 0.0
+    assert model.weighted_energy() == weighted_energy(data, 0.0, TESTFP, TESTKEXP)
+    model.removecarrier('MEDIOAMBIENTE')
+    del data['MEDIOAMBIENTE']
+    assert model.weighted_energy() == weighted_energy(data, 0.0, TESTFP, TESTKEXP)
+    try:
+        model.setseries('ELECTRICIDAD', 'CONSUMO', 'EPB', [1.0, 2.0])
+    except ValueError as e:
+        assert 'same number of timesteps' in str(e)
+    else:
+        assert False
+    # rejected carriers leave the model unchanged
+    try:
+        model.setcarrier('GASNATURAL', {'CONSUMO': {'EPB': [1.0] * 12, 'NEPB': [1.0, 2.0]}})
+    except ValueError as e:
+        assert 'same number of timesteps' in str(e)
+    else:
+        assert False
+    assert model.carriers == ['ELECTRICIDAD'] and model.numsteps == 12
+    # the only carrier can be replaced by one with a different number of timesteps
+    model.setcarrier('ELECTRICIDAD', {'CONSUMO': {'EPB': [1.0, 2.0]}})
+    assert model.numsteps == 2
+    assert model.weighted_energy() == weighted_energy({'ELECTRICIDAD': model.carrierdata('ELECTRICIDAD')},
+                                                      0.0, TESTFP, TESTKEXP)
+
+def test_onlinecalculator():
+    from pytest import approx
+    from pyepbd.online import OnlineCalculator
+    for example in ('ejemplo3PVBdC', 'ejemplo4cgnfosil', 'ejemplo6K3'):
+        data = readenergyfile(os.path.join(currpath, '../examples/%s.csv' % example))
+        calc = OnlineCalculator(TESTFP, TESTKRDEL, TESTKEXP)
+        for start in range(0, 12, 5):
+            batch = {carrier: {ctype: {originoruse: values[start:start + 5]
+                                       for (originoruse, values) in data[carrier][ctype].items()}
+                               for ctype in data[carrier]}
+                     for carrier in data}
+            calc.update(batch)
+        assert calc.numsteps == 12
+        EP = calc.weighted_energy()
+        EPbatch = weighted_energy(data, TESTKRDEL, TESTFP, TESTKEXP)
+        for key in ('EP', 'EPpasoA'):
+            assert EP[key] == approx(EPbatch[key], rel=1e-9, abs=1e-9)
+
+def test_compactenergydata():
+    import pickle
+    from pyepbd.energydata import CarrierData
+    datafile = os.path.join(currpath, '../examples/ejemplo3PVBdC.csv')
+    data = readenergyfile(datafile)
+    compact = readenergyfile(datafile, compact=True)
+    assert isinstance(compact['ELECTRICIDAD'], CarrierData)
+    # only non zero series are stored
+    assert len(compact['ELECTRICIDAD'].values) == 2 * 12
+    for carrier in data:
+        for ctype in data[carrier]:
+            for originoruse in data[carrier][ctype]:
+                assert list(compact[carrier][ctype][originoruse]) == list(data[carrier][ctype][originoruse])
+        assert compact[carrier].todict() == data[carrier]
+    assert weighted_energy(compact, TESTKRDEL, TESTFP, TESTKEXP) == weighted_energy(data, TESTKRDEL, TESTFP, TESTKEXP)
+    assert pickle.loads(pickle.dumps(compact))['ELECTRICIDAD'].todict() == data['ELECTRICIDAD']
+    compact = readenergydata(FROMDATA, compact=True)
+    assert weighted_energy(compact, TESTKRDEL, TESTFP, TESTKEXP) == weighted_energy(readenergydata(FROMDATA), TESTKRDEL, TESTFP, TESTKEXP)
+
+def test_energycomponents_temporal():
+    from pyepbd.energycalculations import energycomponents
+    data = readenergyfile(os.path.join(currpath, '../examples/ejemplo3PVBdC.csv'))
+    components = energycomponents(data, TESTKRDEL)
+    assert set(components['ELECTRICIDAD']) == set(['anual'])
+    components_t = energycomponents(data, TESTKRDEL, temporal=True)
+    assert len(components_t['ELECTRICIDAD']['temporal']['INSITU']['to_grid']) == 12
+    for carrier in data:
+        assert components[carrier]['anual'] == components_t[carrier]['anual']
+
+def test_fused_backend():
+    from pytest import approx
+    from pyepbd.energycalculations import energycomponents
+    examples = ['ejemplo1base', 'ejemplo1PV', 'ejemplo1xPV', 'ejemplo2xPVgas', 'ejemplo3PVBdC',
+                'ejemplo4cgnfosil', 'ejemplo5cgnbiogas', 'ejemplo6K3']
+    for example in examples:
+        data = readenergyfile(os.path.join(currpath, '../examples/%s.csv' % example))
+        for k_rdel in (0.0, 0.5, 1.0):
+            EP = weighted_energy(data, k_rdel, CTEFP, TESTKEXP)
+            EPfused = weighted_energy(data, k_rdel, CTEFP, TESTKEXP, backend='fused')
+            for key in ('EP', 'EPpasoA'):
+                assert EPfused[key] == approx(EP[key], rel=1e-9, abs=1e-9)
+            components = energycomponents(data, k_rdel, temporal=True)
+            components_fused = energycomponents(data, k_rdel, backend='fused', temporal=True)
+            for carrier in data:
+                temporal, temporal_fused = components[carrier]['temporal'], components_fused[carrier]['temporal']
+                assert list(temporal_fused['grid']['input']) == approx(list(temporal['grid']['input']), rel=1e-9, abs=1e-9)
+                for origin in ('INSITU', 'COGENERACION'):
+                    for use in ('input', 'to_nEPB', 'to_grid'):
+                        assert list(temporal_fused[origin][use]) == approx(list(temporal[origin][use]), rel=1e-9, abs=1e-9)
+
+def test_fused_backend_noproduction():
+    from pytest import approx
+    from pyepbd.energycalculations import energycomponents
+    # negative EPB consumption exports energy in timesteps without production
+    data = readenergydata([
+        {'carrier': 'ELECTRICIDAD', 'ctype': 'CONSUMO', 'originoruse': 'EPB', 'values': [-5.0, 10.0, 20.0, -3.0]},
+        {'carrier': 'ELECTRICIDAD', 'ctype': 'CONSUMO', 'originoruse': 'NEPB', 'values': [1.0, 0.0, 2.0, 0.0]},
+        {'carrier': 'ELECTRICIDAD', 'ctype': 'PRODUCCION', 'originoruse': 'INSITU', 'values': [0.0, 4.0, 30.0, 0.0]}])
+    for k_rdel in (0.0, 1.0):
+        components = energycomponents(data, k_rdel, temporal=True)['ELECTRICIDAD']
+        components_fused = energycomponents(data, k_rdel, backend='fused', temporal=True)['ELECTRICIDAD']
+        for origin in components['anual']:
+            assert components_fused['anual'][origin] == approx(components['anual'][origin], rel=1e-9, abs=1e-9)
+        for origin in components['temporal']:
+            for use in components['temporal'][origin]:
+                assert (list(components_fused['temporal'][origin][use])
+                        == approx(list(components['temporal'][origin][use]), rel=1e-9, abs=1e-9))
+
+def test_periodcomponents():
+    from pytest import approx
+    from pyepbd.energycalculations import energycomponents
+    from pyepbd.periods import periodcomponents, monthperiods, rangesfromlengths
+    assert monthperiods(8760)[1] == (744, 1416)
+    assert monthperiods(35040)[-1] == (35040 - 31 * 96, 35040)
+    data = readenergyfile(os.path.join(currpath, '../examples/ejemplo3PVBdC.csv'))
+    for backend in ('python', 'fused'):
+        components = energycomponents(data, TESTKRDEL, backend, temporal=True)
+        monthly = periodcomponents(components, monthperiods(12))
+        assert len(monthly['ELECTRICIDAD']) == 12
+        assert monthly['ELECTRICIDAD'][0]['INSITU']['input'] == approx(1.13)
+        # seasons add up to annual values
+        seasons = periodcomponents(components, rangesfromlengths([3, 3, 3, 3]))
+        for carrier in data:
+            for source, uses in components[carrier]['anual'].items():
+                for use, value in uses.items():
+                    assert sum(season[source][use] for season in seasons[carrier]) == approx(value)
+    try:
+        periodcomponents(energycomponents(data, TESTKRDEL), monthperiods(12))
+    except ValueError as e:
+        assert 'temporal=True' in str(e)
+    else:
+        assert False
+
+def test_exportcomponents(tmp_path):
+    import csv
+    from pyepbd.energycalculations import energycomponents
+    from pyepbd.export import exportcomponents
+    from pyepbd.binaryio import readcomponentsbinary
+    names = ['ejemplo3PVBdC', 'ejemplo6K3']
+    datas = [readenergyfile(os.path.join(currpath, '../examples/%s.csv' % name)) for name in names]
+    binfilename = str(tmp_path / 'componentes.epbdbin')
+    csvfilename = str(tmp_path / 'componentes.csv')
+    assert exportcomponents(zip(names, datas), TESTKRDEL, binfilename, csvfilename, chunksize=7) == 2
+    components = energycomponents(datas[1], TESTKRDEL, 'fused', temporal=True)
+    with readcomponentsbinary(binfilename) as binfile:
+        assert binfile.ids == names
+        exported = binfile.components('ejemplo6K3')
+        for source in ('grid', 'INSITU'):
+            for use in components['ELECTRICIDAD']['temporal'][source]:
+                assert list(exported['ELECTRICIDAD'][source][use]) == list(components['ELECTRICIDAD']['temporal'][source][use])
+    with open(csvfilename) as ff:
+        rows = list(csv.DictReader(ff))
+    row = [row for row in rows if row['id'] == 'ejemplo6K3' and row['fuente'] == 'INSITU'
+           and row['uso'] == 'input' and row['paso'] == '3'][0]
+    assert float(row['valor']) == components['ELECTRICIDAD']['temporal']['INSITU']['input'][3]
+    assert len(rows) == sum(12 * len(uses) for data in datas for carrier in data
+                            for uses in energycomponents(data, TESTKRDEL, 'fused', temporal=True)[carrier]['temporal'].values())
+
+def test_checkfactors():
+    from pyepbd.energycalculations import energycomponents, requiredfactors, missingfactors, checkfactors
+    data = readenergyfile(os.path.join(currpath, '../examples/ejemplo6K3.csv'))
+    components = energycomponents(data, 1.0)
+    assert requiredfactors(components) == set([('ELECTRICIDAD', 'INSITU', 'input', 'A'),
+                                               ('ELECTRICIDAD', 'INSITU', 'to_nEPB', 'A'),
+                                               ('ELECTRICIDAD', 'INSITU', 'to_nEPB', 'B'),
+                                               ('ELECTRICIDAD', 'INSITU', 'to_grid', 'A'),
+                                               ('ELECTRICIDAD', 'INSITU', 'to_grid', 'B')])
+    # delivered energy is not fully redelivered without k_rdel
+    assert (requiredfactors(energycomponents(data, 0.0))
+            == requiredfactors(components) | set([('ELECTRICIDAD', 'grid', 'input', 'A')]))
+    checkfactors(energycomponents(data, 0.0), CTEFP)
+    fp = [fpi for fpi in CTEFP if fpi['uso'] != 'to_grid']
+    assert missingfactors(components, fp) == [('ELECTRICIDAD', 'INSITU', 'to_grid', 'A'),
+                                              ('ELECTRICIDAD', 'INSITU', 'to_grid', 'B')]
+    try:
+        checkfactors(components, fp)
+    except ValueError as e:
+        assert 'ELECTRICIDAD, INSITU, to_grid, B' in str(e)
+    else:
+        assert False
+    # checked weighted energy reports all missing factors, computing the balance once
+    from pyepbd.profiling import profile
+    with profile() as report:
+        try:
+            weighted_energy(data, 1.0, fp, TESTKEXP, check=True)
+        except ValueError as e:
+            assert 'ELECTRICIDAD, INSITU, to_grid, A; ELECTRICIDAD, INSITU, to_grid, B' in str(e)
+        else:
+            assert False
+        EP = weighted_energy(data, 1.0, CTEFP, TESTKEXP, check=True)
+    assert [stage['calls'] for stage in report.summary() if stage['stage'] == 'energycomponents'] == [2]
+    assert EP == weighted_energy(data, 1.0, CTEFP, TESTKEXP)
+
+def test_checkfactors_annual():
+    from pyepbd.energycalculations import energycomponents, requiredfactors, checkfactors
+    # MEDIOAMBIENTE production equals consumption over the year, but not in every timestep,
+    # and ELECTRICIDAD exports some energy, but less than 0.1 over the year
+    data = readenergydata([
+        {'carrier': 'MEDIOAMBIENTE', 'ctype': 'CONSUMO', 'originoruse': 'EPB', 'values': [10.0, 20.0, 15.0]},
+        {'carrier': 'MEDIOAMBIENTE', 'ctype': 'PRODUCCION', 'originoruse': 'INSITU', 'values': [15.0, 15.0, 15.0]},
+        {'carrier': 'ELECTRICIDAD', 'ctype': 'CONSUMO', 'originoruse': 'EPB', 'values': [10.0, 10.0, 10.0]},
+        {'carrier': 'ELECTRICIDAD', 'ctype': 'PRODUCCION', 'originoruse': 'INSITU', 'values': [10.05, 5.0, 0.0]}])
+    assert requiredfactors(energycomponents(data, 1.0)) == set([('ELECTRICIDAD', 'grid', 'input', 'A'),
+                                                                ('ELECTRICIDAD', 'INSITU', 'input', 'A'),
+                                                                ('MEDIOAMBIENTE', 'INSITU', 'input', 'A')])
+    EP = weighted_energy(data, 1.0, CTEFP, TESTKEXP, check=True)
+    assert EP == weighted_energy(data, 1.0, CTEFP, TESTKEXP, backend='fused', check=True)
+    # there is no grid input factor for MEDIOAMBIENTE
+    components = energycomponents(data, 0.0)
+    assert ('MEDIOAMBIENTE', 'grid', 'input', 'A') in requiredfactors(components)
+    try:
+        checkfactors(components, CTEFP)
+    except ValueError as e:
+        assert 'MEDIOAMBIENTE, grid, input, A' in str(e)
+    else:
+        assert False
+
+def test_runpipeline():
+    import io, json
+    from pyepbd.pipeline import runpipeline
+    filenames = [os.path.join(currpath, '../examples/%s.csv' % name)
+                 for name in ('ejemplo6K3', 'ejemplo3PVBdC', 'ejemplo1base', 'ejemplo1PV')]
+    filenames.append(os.path.join(currpath, 'noexiste.csv'))
+    fpfilename = os.path.join(currpath, '../examples/factores_paso_test.csv')
+    for jobs in (1, 2):
+        outfile = io.StringIO()
+        stats = runpipeline(filenames, outfile, fpfilename, TESTKRDEL, TESTKEXP, jobs=jobs, fmt='jsonl',
+                            readers=2, queuesize=1)
+        rows = dict((row['file'], row) for row in map(json.loads, outfile.getvalue().splitlines()))
+        assert (stats['buildings'], stats['errors']) == (5, 1)
+        assert stats['rate'] > 0
+        assert sorted(rows) == sorted(filenames)
+        assert rows[filenames[-1]]['status'] == 'error'
+        assert abs(rows[filenames[0]]['EPren'] - 1385.5) < 0.1 and abs(rows[filenames[0]]['EPnren'] + 662) < 0.1
+    for badsetting in ({'jobs': 0}, {'readers': 0}, {'queuesize': 0}):
+        try:
+            runpipeline(filenames, io.StringIO(), fpfilename, **badsetting)
+        except ValueError:
+            pass
+        else:
+            assert False
+
+def test_positiveint():
+    import argparse
+    from pyepbd.cli import positiveint
+    assert positiveint('3') == 3
+    for value in ('0', '-1'):
+        try:
+            positiveint(value)
+        except argparse.ArgumentTypeError:
+            pass
+        else:
+            assert False
+
+def test_readbuildingsfile(buildingsfile):
+    from pyepbd import readbuildingsfile
+    names = ['ejemplo3PVBdC', 'ejemplo4cgnfosil', 'ejemplo6K3']
+    datafile = buildingsfile(names)
+    buildings = readbuildingsfile(datafile)
+    assert not isinstance(buildings, (list, dict))
+    buildings = list(buildings)
+    assert [buildingid for (buildingid, data) in buildings] == names
+    for (buildingid, data) in buildings:
+        assert data == readenergyfile(os.path.join(currpath, '../examples/%s.csv' % buildingid))
+    compact = dict(readbuildingsfile(datafile, compact=True))
+    assert weighted_energy(compact['ejemplo6K3'], TESTKRDEL, TESTFP, TESTKEXP) == weighted_energy(buildings[2][1], TESTKRDEL, TESTFP, TESTKEXP)
+    # lines of a building must be consecutive
+    with open(datafile, 'a') as ff:
+        ff.write(u'ejemplo3PVBdC,ELECTRICIDAD,CONSUMO,NEPB,' + u','.join([u'1.0'] * 12) + u'\n')
+    try:
+        list(readbuildingsfile(datafile))
+    except ValueError as e:
+        assert 'not consecutive' in str(e)
+    else:
+        assert False
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# 
+# Copyright (c) 2015 Ministerio de Fomento
+#                    Instituto de Ciencias de la Construcción Eduardo Torroja (IETcc-CSIC)
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Proceso de cálculo de peticiones JSON-lines por la entrada y salida estándar
+
+Lee una petición JSON por línea de la entrada estándar y escribe una
+respuesta JSON por línea en la salida estándar, en el mismo orden:
+
+    $ python -m pyepbd worker -f cte=factores_paso_20140203.csv < peticiones.jsonl
+
+Las peticiones tienen el formato del servicio HTTP (ver service), con
+una clave opcional 'id' que se copia en la respuesta. La referencia a los
+factores de paso ('factors') puede ser también la ruta de un archivo de
+factores, que se lee una sola vez y se reutiliza en peticiones posteriores.
+
+Las respuestas tienen las claves 'id', 'line' (número de línea de la
+petición), 'status' ('ok' o 'error') y 'result' (ver ep2dict) o 'error'
+(mensaje de error). Un error en una petición no detiene el proceso.
+
+La lectura y decodificación de peticiones y la escritura de respuestas se
+hacen en hilos separados del cálculo, con colas limitadas.
+"""
+
+import argparse
+import json
+import sys
+import threading
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+from .settings import K_EXP, K_RDEL
+from .service import Calculator, loadfactorsets
+from .cli import positiveint
+
+# End of stream mark in queues
+_END = object()
+
+def _readrequests(infile, requests):
+    """Read and decode requests from infile into requests queue"""
+    try:
+        for lineno, line in enumerate(infile, 1):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                request = e
+            requests.put((lineno, request))
+    finally:
+        requests.put(_END)
+
+def _writeresponses(outfile, responses):
+    """Encode and write responses from responses queue to outfile"""
+    while True:
+        response = responses.get()
+        if response is _END:
+            break
+        outfile.write(json.dumps(response) + '\n')
+        outfile.flush()
+
+def process(calculator, lineno, request):
+    """Response for request in line lineno"""
+    requestid = request.get('id') if isinstance(request, dict) else None
+    response = {'id': requestid, 'line': lineno}
+    if isinstance(request, Exception):
+        response.update({'status': 'error', 'error': u'Invalid JSON request: %s' % request})
+        return response
+    try:
+        response.update({'status': 'ok', 'result': calculator.calculate(request)})
+    except Exception as e:
+        response.update({'status': 'error', 'error': u'%s' % e})
+    return response
+
+def runworker(calculator, infile, outfile, queuesize=64):
+    """Process JSON-lines requests from infile and write responses to outfile
+
+    Requests are read and decoded, and responses encoded and written, in
+    their own threads, while calculations run in the calling thread.
+    queuesize (at least 1) limits the number of requests and responses
+    waiting in each queue.
+
+    Returns (number of requests, number of failed requests).
+    """
+    if queuesize < 1:
+        raise ValueError("queuesize must be at least 1")
+    requests = queue.Queue(queuesize)
+    responses = queue.Queue(queuesize)
+    reader = threading.Thread(target=_readrequests, args=(infile, requests))
+    writer = threading.Thread(target=_writeresponses, args=(outfile, responses))
+    reader.daemon = True
+    reader.start()
+    writer.start()
+
+    numrequests = numerrors = 0
+    try:
+        while True:
+            item = requests.get()
+            if item is _END:
+                break
+            response = process(calculator, *item)
+            numrequests += 1
+            numerrors += response['status'] != 'ok'
+            responses.put(response)
+    finally:
+        responses.put(_END)
+        writer.join()
+    return numrequests, numerrors
+
+def main(argv=None, infile=None, outfile=None):
+    parser = argparse.ArgumentParser(prog='python -m pyepbd worker',
+                                     description=u'Cálculo de peticiones JSON-lines por la entrada y salida estándar')
+    parser.add_argument('-f', '--factores', dest='fpfiles', action='append', default=[], metavar='NOMBRE=FPFILE',
+                        help=u'conjunto de factores de paso a cargar, con su nombre (se puede repetir)')
+    parser.add_argument('--krdel', type=float, default=K_RDEL,
+                        help=u'factor de resuministro (k_rdel) predeterminado')
+    parser.add_argument('--kexp', type=float, default=K_EXP,
+                        help=u'factor de exportacion (k_exp) predeterminado')
+    parser.add_argument('--queue', dest='queuesize', type=positiveint, default=64,
+                        help=u'tamaño de las colas de peticiones y respuestas')
+    args = parser.parse_args(argv)
+
+    calculator = Calculator(k_rdel=args.krdel, k_exp=args.kexp, allowfiles=True)
+    loadfactorsets(calculator, args.fpfiles, parser)
+
+    numrequests, numerrors = runworker(calculator, infile or sys.stdin, outfile or sys.stdout, args.queuesize)
+    sys.stderr.write(u'Procesadas %i peticiones (%i con errores)\n' % (numrequests, numerrors))
@@ -108,6 +108,7 @@ setup(
     # $ pip install -e .[dev,test]
     extras_require={
         'test': ['pytest', 'pytest-cov'],
+        'numpy': ['numpy'],
     },
 
     # To provide executable scripts, use entry points in preference to the